@@ -17,14 +17,18 @@ cors = CORS(app,
             },
             supports_credentials=True)
 
-from .recommender import CombinedRecommender
+from .cache import RecommendationCache, PlacePayloadCache
+from .spatial import PlaceIndex
+from .search import AutocompleteIndex
+from .popularity import PopularityRanking
+from .training import RecommenderLoader
 
-recommender = CombinedRecommender()
-try:
-    recommender.load()
-except FileNotFoundError:
-    print('Saved recommender not found, fitting from database...')
-    recommender.fit()
-    print('Complete.')
+place_index = PlaceIndex()
+autocomplete_index = AutocompleteIndex()
+recommendation_cache = RecommendationCache()
+place_cache = PlacePayloadCache()
+popularity_ranking = PopularityRanking()
+recommender_loader = RecommenderLoader(recommendation_cache, [place_index, autocomplete_index, popularity_ranking],
+                                       popularity_ranking)
 
-from . import views, models
+from . import views, models, commands
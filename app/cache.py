@@ -0,0 +1,191 @@
+from app import app
+from .models import Place
+from .serial import serialize, encode_json
+from collections import OrderedDict
+import threading
+import tempfile
+import shutil
+import time
+import os
+import numpy as np
+
+
+class RecommendationCache:
+    '''
+    Per-user ranked place IDs, each kept with the recommender version it was computed by, in an
+    in-memory LRU with an optional on-disk tier shared by the web processes, one directory per version.
+    Rankings of an older version are not served, users are ranked again when they next ask
+    '''
+    def __init__(self,
+                 max_size=app.config['RECOMMENDATION_CACHE_SIZE'],
+                 depth=app.config['RECOMMENDATION_CACHE_DEPTH'],
+                 cache_dir=app.config['RECOMMENDATION_CACHE_DIR']):
+        self.max_size = max_size
+        self.depth = depth
+        self.cache_dir = cache_dir
+        self.rankings = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+
+    def _path(self, user_id, version):
+        return os.path.join(self.cache_dir, str(version), '{}.npy'.format(user_id))
+
+    def get(self, user_id, version):
+        with self.lock:
+            cached_version, ranking = self.rankings.get(user_id, (None, None))
+            if ranking is not None and cached_version == version:
+                self.rankings.move_to_end(user_id)
+                return ranking
+
+        if not self.cache_dir:
+            return None
+
+        try:
+            ranking = np.load(self._path(user_id, version))
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+        self._remember(user_id, ranking, version)
+        return ranking
+
+    def put(self, user_id, ranking, version):
+        ranking = np.asarray(ranking)[:self.depth]
+        self._remember(user_id, ranking, version)
+
+        if self.cache_dir:
+            # Write to a temporary file first so readers never see a partial array
+            path = self._path(user_id, version)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, ranking)
+            os.replace(tmp_path, path)
+
+    def _remember(self, user_id, ranking, version):
+        with self.lock:
+            self.rankings[user_id] = (version, ranking)
+            self.rankings.move_to_end(user_id)
+            while len(self.rankings) > self.max_size:
+                self.rankings.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.rankings.pop(user_id, None)
+
+        if self.cache_dir:
+            try:
+                os.remove(self._path(user_id, self.version))
+            except FileNotFoundError:
+                pass
+
+    def switch(self, recommender):
+        '''
+        Move to a newly loaded recommender version. Nothing is ranked here, the cached rankings of
+        the previous version only stop being served
+        '''
+        self.version = recommender.version
+
+        # Directories of older versions, another process may still be switching and just miss then
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name < str(self.version):
+                    shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+    def recommend(self, recommender, user_id, filter_place_ids=None, k=None):
+        ranking = self.get(user_id, recommender.version)
+        if ranking is None:
+            ranking = recommender.recommend(user_id, k=self.depth)
+            self.put(user_id, ranking, recommender.version)
+
+        if filter_place_ids is None:
+            return ranking[:k]
+        if len(filter_place_ids) == 0:
+            return ranking[:0]
+
+        filtered = ranking[np.isin(ranking, filter_place_ids)]
+
+        # A truncated ranking may not contain enough of the filtered places, score them directly then
+        wanted = min(k or self.depth, len(filter_place_ids))
+        if len(ranking) < recommender.n_places and len(filtered) < wanted:
+            return recommender.recommend(user_id, filter_place_ids, k)
+
+        return filtered[:k]
+
+
+class PlacePayloadCache:
+    '''
+    Serialized places as pre-encoded JSON fragments by place ID, in an in-process LRU in front of
+    an optional shared backend with the werkzeug cache interface (get_many, set_many, delete_many).
+    invalidate() only reaches other processes through the backend, without one their in-process
+    entries go stale for up to local_ttl seconds
+    '''
+    def __init__(self,
+                 max_size=app.config['PLACE_CACHE_SIZE'],
+                 backend=app.config['PLACE_CACHE_BACKEND'],
+                 timeout=app.config['PLACE_CACHE_TIMEOUT'],
+                 local_ttl=app.config['PLACE_CACHE_LOCAL_TTL']):
+        self.max_size = max_size
+        self.backend = backend
+        self.timeout = timeout
+        self.local_ttl = local_ttl
+        self.fragments = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(place_id):
+        return 'place:{}'.format(place_id)
+
+    def _remember(self, fragments):
+        expires = time.monotonic() + self.local_ttl
+        with self.lock:
+            for place_id, fragment in fragments.items():
+                self.fragments[place_id] = (fragment, expires)
+                self.fragments.move_to_end(place_id)
+            while len(self.fragments) > self.max_size:
+                self.fragments.popitem(last=False)
+
+    def get_many(self, place_ids):
+        '''
+        JSON fragments for place_ids in the same order, None for places that do not exist.
+        Misses are filled from the backend, then from the database with a single query
+        '''
+        found = {}
+        now = time.monotonic()
+        with self.lock:
+            for place_id in place_ids:
+                fragment, expires = self.fragments.get(place_id, (None, None))
+                if fragment is not None and expires > now:
+                    self.fragments.move_to_end(place_id)
+                    found[place_id] = fragment
+
+        missing = list({place_id for place_id in place_ids if place_id not in found})
+
+        if missing and self.backend is not None:
+            cached = dict(zip(missing, self.backend.get_many(*map(self._key, missing))))
+            cached = {place_id: fragment for place_id, fragment in cached.items() if fragment is not None}
+            self._remember(cached)
+            found.update(cached)
+            missing = [place_id for place_id in missing if place_id not in cached]
+
+        if missing:
+            loaded = {place.id: encode_json(serialize(place))
+                      for place in Place.query.filter(Place.id.in_(missing))}
+            self._remember(loaded)
+            found.update(loaded)
+            if self.backend is not None and loaded:
+                self.backend.set_many({self._key(place_id): fragment for place_id, fragment in loaded.items()},
+                                      timeout=self.timeout)
+
+        return [found.get(place_id) for place_id in place_ids]
+
+    def invalidate(self, *place_ids):
+        with self.lock:
+            for place_id in place_ids:
+                self.fragments.pop(place_id, None)
+
+        if self.backend is not None and place_ids:
+            self.backend.delete_many(*map(self._key, place_ids))
+
+    def clear(self):
+        with self.lock:
+            self.fragments.clear()
@@ -0,0 +1,76 @@
+from app import app
+from .recommender import CombinedRecommender
+from .importer import TripadvisorImporter
+from .training import TrainingWorker
+import click
+import json
+
+
+@app.cli.group('recommender')
+def recommender_cli():
+    '''
+    Recommender maintenance commands
+    '''
+
+
+@recommender_cli.command('train')
+def train():
+    '''
+    Fit the recommender from the database and save it as the current artifact
+    '''
+    recommender = CombinedRecommender()
+    recommender.fit()
+    click.echo('Saved recommender version {}'.format(recommender.version))
+
+
+@recommender_cli.command('worker')
+def worker():
+    '''
+    Train the recommender on new ratings and save it for the web processes. Run exactly one
+    '''
+    TrainingWorker().run()
+
+
+@recommender_cli.command('recommend')
+@click.argument('user_ids', nargs=-1, type=int)
+@click.option('-k', default=20, help='Number of places to recommend per user')
+@click.option('--output', type=click.File('w'), default='-', help='JSON lines output file')
+def recommend_batch(user_ids, k, output):
+    '''
+    Write top k recommendations for the given (or all known) users
+    '''
+    recommender = CombinedRecommender()
+    recommender.load()
+    if not user_ids:
+        user_ids = list(recommender.user_model_map)
+
+    unknown = [user_id for user_id in user_ids if user_id not in recommender.user_model_map]
+    if unknown:
+        click.echo('Skipping users unknown to the recommender: {}'.format(unknown), err=True)
+    user_ids = [user_id for user_id in user_ids if user_id in recommender.user_model_map]
+
+    for user_id, ranking in zip(user_ids, recommender.recommend_batch(user_ids, k)):
+        output.write(json.dumps({'user_id': user_id, 'places': ranking.tolist()}) + '\n')
+
+
+@app.cli.group('tripadvisor')
+def tripadvisor_cli():
+    '''
+    TripAdvisor data commands
+    '''
+
+
+@tripadvisor_cli.command('import')
+@click.argument('input', type=click.File('r'))
+@click.option('--batch-size', default=app.config['IMPORT_BATCH_SIZE'], help='Rows written per batch')
+@click.option('--retrain/--no-retrain', default=True, help='Fit the recommender after the import')
+def import_tripadvisor(input, batch_size, retrain):
+    '''
+    Import restaurants and reviews from a JSON lines dump of the restaurants spider
+    '''
+    importer = TripadvisorImporter(batch_size)
+    for line in input:
+        if line.strip():
+            importer.add(json.loads(line))
+    importer.finish(retrain)
+    click.echo('Imported {} places and {} reviews'.format(importer.imported_places, importer.imported_reviews))
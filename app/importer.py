@@ -0,0 +1,141 @@
+from app import app, db, place_cache
+from .models import User, Place, PLACE_RESTAURANT, upsert_reviews
+from .recommender import CombinedRecommender
+from sqlalchemy.dialects.postgresql import insert
+
+
+def place_url(url):
+    # Places keep the last path component of their TripAdvisor page, as /p/create stores it
+    return url.split('/')[-1] if url else None
+
+
+def clean(value):
+    # TripAdvisor sometimes pads fields with spaces and commas
+    return (value.strip(' ,') or None) if isinstance(value, str) else value
+
+
+class TripadvisorImporter:
+    '''
+    Buffers scraped restaurants and reviews and writes them with a few multi-row
+    INSERT ... ON CONFLICT statements per batch, instead of one ORM insert per row
+    '''
+    def __init__(self, batch_size=app.config['IMPORT_BATCH_SIZE']):
+        self.batch_size = batch_size
+        self.places = {}
+        self.reviews = []
+        self.imported_places = 0
+        self.imported_reviews = 0
+
+    def add(self, item):
+        '''
+        Buffer a restaurant or one of its reviews, which the spider yields as separate items
+        '''
+        if 'restaurant_url' in item:
+            self.add_review(place_url(item['restaurant_url']), item)
+        else:
+            self.add_restaurant(item)
+
+        if len(self.places) + len(self.reviews) >= self.batch_size:
+            self.flush()
+
+    def add_restaurant(self, item):
+        url = place_url(item.get('url'))
+        if url is None:
+            return
+
+        address = ', '.join(filter(None, map(clean, (item.get('street_address'), item.get('locality'),
+                                                     item.get('country')))))
+        # Place ratings are stored on the bubble scale, 45 for 4.5
+        rating = item.get('avg_rating')
+        self.places[url] = {'tripadvisor_url': url,
+                            'name': clean(item.get('name')),
+                            'address': address or None,
+                            'image_url': item.get('img'),
+                            'rating': int(round(rating * 10)) if rating is not None else None}
+
+        # Dumps from before reviews were yielded separately nest them in the restaurant
+        for review in item.get('reviews', []):
+            self.add_review(url, review)
+
+    def add_review(self, url, review):
+        if url is None or not review.get('uid'):
+            return
+
+        rating = review.get('rating')
+        self.reviews.append((url, review['uid'], {'rating': int(round(rating)) if rating is not None else None,
+                                                  'title': clean(review.get('title')),
+                                                  'content': clean(review.get('content'))}))
+
+    def _upsert_places(self, places, reviews):
+        place_ids = {}
+
+        if places:
+            statement = insert(Place.__table__).values([dict(place, place_type=PLACE_RESTAURANT)
+                                                        for place in places.values()])
+            # Only the scraped columns are refreshed, coordinates and naviaddresses set later are kept
+            statement = statement.on_conflict_do_update(
+                index_elements=['tripadvisor_url'],
+                set_={column: statement.excluded[column] for column in ('name', 'address', 'image_url', 'rating')})
+            rows = db.session.execute(statement.returning(Place.__table__.c.id, Place.__table__.c.tripadvisor_url))
+            place_ids.update((url, place_id) for place_id, url in rows)
+
+        # Reviews of restaurants imported in an earlier batch
+        missing = {url for url, _, _ in reviews if url not in place_ids}
+        if missing:
+            place_ids.update((url, place_id) for place_id, url in
+                             db.session.query(Place.id, Place.tripadvisor_url)
+                                       .filter(Place.tripadvisor_url.in_(missing)))
+
+        return place_ids
+
+    def _upsert_users(self, reviews):
+        uids = list({uid for _, uid, _ in reviews})
+        if not uids:
+            return {}
+
+        db.session.execute(insert(User.__table__).values([{'tripadvisor_uid': uid} for uid in uids])
+                                                 .on_conflict_do_nothing(index_elements=['tripadvisor_uid']))
+        return {uid: user_id for user_id, uid in
+                db.session.query(User.id, User.tripadvisor_uid).filter(User.tripadvisor_uid.in_(uids))}
+
+    def flush(self):
+        if not self.places and not self.reviews:
+            return
+
+        places, self.places = self.places, {}
+        buffered, self.reviews = self.reviews, []
+
+        # A failed batch is dropped rather than retried with every later one. The rollback ends the
+        # aborted transaction, so the following batches can still be written
+        try:
+            place_ids = self._upsert_places(places, buffered)
+            user_ids = self._upsert_users(buffered)
+
+            # A single statement can not update the same row twice, the last review of a user for a place wins
+            reviews = {}
+            for url, uid, review in buffered:
+                if url in place_ids and uid in user_ids:
+                    reviews[user_ids[uid], place_ids[url]] = dict(review, user_id=user_ids[uid],
+                                                                  place_id=place_ids[url])
+            upsert_reviews(list(reviews.values()))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        # Web processes only see this through PLACE_CACHE_BACKEND, or after PLACE_CACHE_LOCAL_TTL
+        updated = [place_ids[url] for url in places]
+        if updated:
+            place_cache.invalidate(*updated)
+
+        self.imported_places += len(places)
+        self.imported_reviews += len(reviews)
+
+    def finish(self, retrain=True):
+        '''
+        Write what is left and fit the recommender once on the imported data. Web workers pick
+        the new artifact up on their next reload
+        '''
+        self.flush()
+        if retrain and self.imported_reviews:
+            CombinedRecommender().fit()
@@ -1,12 +1,18 @@
 from . import db, bcrypt, login_manager
 from flask_login import UserMixin
-from geoalchemy2.types import Geography
+from geoalchemy2.types import Geography, Geometry
+from sqlalchemy import cast, func
+from sqlalchemy.dialects.postgresql import insert
 
 PLACE_DEFAULT = 0
 PLACE_RESTAURANT = 1
 PLACE_CAFE = 2
 PLACE_BAR = 3
 
+# Part of the metadata rather than a column default, so that multi-row inserts draw numbers in the
+# server default instead of prefetching one per row
+review_modified_seq = db.Sequence('review_modified_seq', metadata=db.metadata)
+
 
 class User(db.Model, UserMixin):
     id =              db.Column(db.Integer, primary_key=True)
@@ -44,22 +50,55 @@ class User(db.Model, UserMixin):
 class Place(db.Model):
     id =              db.Column(db.Integer, primary_key=True)
     name =            db.Column(db.Text, index=True)
-    location =        db.Column(Geography('POINT'))
+    location =        db.Column(Geography('POINT', spatial_index=False))
     address =         db.Column(db.Text)
-    place_type =      db.Column(db.SmallInteger)
-    tripadvisor_url = db.Column(db.Text)
+    place_type =      db.Column(db.SmallInteger, index=True)
+    tripadvisor_url = db.Column(db.Text, index=True, unique=True)
     image_url =       db.Column(db.Text)
     navicontainer =   db.Column(db.String(18))
     naviaddress =     db.Column(db.String(18))
     rating =          db.Column(db.SmallInteger)
 
+    # Coordinates selected with the row, so serializing a place does not need to decode WKB
+    latitude =        db.column_property(func.ST_Y(cast(location, Geometry), type_=db.Float))
+    longitude =       db.column_property(func.ST_X(cast(location, Geometry), type_=db.Float))
+
     reviews = db.relationship('Review', backref='place', lazy='dynamic')
 
+    __table_args__ = (
+        db.Index('ix_place_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_place_location', 'location', postgresql_using='gist'),
+    )
+
 
 class Review(db.Model):
     id =       db.Column(db.Integer, primary_key=True)
     user_id =  db.Column(db.Integer, db.ForeignKey('user.id'))
-    place_id = db.Column(db.Integer, db.ForeignKey('place.id'))
+    place_id = db.Column(db.Integer, db.ForeignKey('place.id'), index=True)
     rating =   db.Column(db.SmallInteger)
     title =    db.Column(db.Text)
     content =  db.Column(db.Text)
+    # Drawn from a sequence on every insert and update, the trainer reads changed reviews by it
+    modified = db.Column(db.BigInteger, server_default=review_modified_seq.next_value(), index=True)
+
+    __table_args__ = (
+        db.Index('ix_review_user_id_place_id', 'user_id', 'place_id', unique=True),
+        # Matches the ORDER BY of GET /r, so a user's reviews are read in order without a sort
+        db.Index('ix_review_user_id_rating', user_id, rating.desc().nullslast(), id),
+    )
+
+
+def upsert_reviews(reviews):
+    '''
+    Insert reviews (dicts with user_id, place_id and other Review columns) with a single
+    INSERT ... ON CONFLICT statement, updating the other columns of existing (user_id, place_id) reviews
+    and their modified sequence number. The caller commits
+    '''
+    if not reviews:
+        return
+
+    statement = insert(Review.__table__).values(reviews)
+    update = {column: statement.excluded[column] for column in reviews[0] if column not in ('user_id', 'place_id')}
+    update['modified'] = review_modified_seq.next_value()
+    statement = statement.on_conflict_do_update(index_elements=['user_id', 'place_id'], set_=update)
+    db.session.execute(statement)
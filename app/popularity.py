@@ -0,0 +1,52 @@
+from app import app, db, models
+from .snapshot import Snapshot
+from sqlalchemy import func
+import numpy as np
+
+
+class PopularityRanking(Snapshot):
+    '''
+    Place IDs ordered by a popularity score mixing the stored rating, the number of reviews and how
+    recently the place was reviewed, so cold-start recommendations are a filter over a precomputed array
+    '''
+    def __init__(self,
+                 count_weight=app.config['POPULARITY_COUNT_WEIGHT'],
+                 recency_weight=app.config['POPULARITY_RECENCY_WEIGHT'],
+                 ttl=app.config['POPULARITY_TTL']):
+        super().__init__(ttl)
+        self.count_weight = count_weight
+        self.recency_weight = recency_weight
+
+    def build(self):
+        reviews = db.session.query(models.Review.place_id.label('place_id'),
+                                   func.count(models.Review.id).label('count'),
+                                   func.max(models.Review.id).label('latest'))\
+                            .filter(models.Review.place_id.isnot(None))\
+                            .group_by(models.Review.place_id)\
+                            .subquery()
+        rows = db.session.query(models.Place.id, models.Place.rating, reviews.c.count, reviews.c.latest)\
+                         .outerjoin(reviews, reviews.c.place_id == models.Place.id)\
+                         .all()
+
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        ratings = np.array([row[1] or 0 for row in rows], dtype=np.float64)
+        counts = np.log1p(np.array([row[2] or 0 for row in rows], dtype=np.float64))
+        latest = np.array([row[3] or 0 for row in rows], dtype=np.int64)
+
+        # Reviews have no timestamps, but their IDs grow over time, so rank places by their newest review
+        recency = np.zeros(len(rows))
+        reviewed = np.flatnonzero(latest)
+        recency[reviewed[np.argsort(latest[reviewed])]] = np.arange(1, len(reviewed) + 1)
+
+        score = (ratings / max(ratings.max(initial=0), 1) +
+                 self.count_weight * counts / max(counts.max(initial=0), 1) +
+                 self.recency_weight * recency / max(len(reviewed), 1))
+
+        return ids[np.argsort(-score, kind='mergesort')]
+
+    def recommend(self, filter_place_ids=None, k=None):
+        ranking = self.current()
+        if filter_place_ids is not None:
+            ranking = ranking[np.isin(ranking, filter_place_ids)]
+
+        return ranking[:k]
@@ -1,7 +1,14 @@
-from app import app, models
+from app import app, db, models
 from lightfm import LightFM
 from lightfm.data import Dataset
+from scipy.sparse import coo_matrix
+from itertools import islice
 import pickle
+import tempfile
+import shutil
+import json
+import time
+import os
 import numpy as np
 
 
@@ -9,8 +16,92 @@ LIGHTFM_LOSS = 'warp'
 LIGHTFM_COMPONENTS = 32
 LIGHTFM_EPOCHS = 8
 
+RECOMMEND_BATCH_CHUNK_SIZE = 512
+LOADER_CHUNK_SIZE = 50000
+
 POSITIVE_FILENAME = 'positive_recommender.pkl'
-COMBINED_FILENAME = 'combined_recommender.pkl'
+
+ARTIFACT_DIR = app.config['RECOMMENDER_ARTIFACT_DIR']
+ARTIFACT_KEEP = app.config['RECOMMENDER_ARTIFACT_KEEP']
+LAG_WINDOW = app.config['RECOMMENDER_LAG_WINDOW']
+ARTIFACT_FORMAT = 1
+
+# LightFM state needed both to score and to continue training with fit_partial
+LIGHTFM_ARRAYS = ['user_embeddings', 'user_embedding_gradients', 'user_embedding_momentum',
+                  'user_biases', 'user_bias_gradients', 'user_bias_momentum',
+                  'item_embeddings', 'item_embedding_gradients', 'item_embedding_momentum',
+                  'item_biases', 'item_bias_gradients', 'item_bias_momentum']
+
+
+def top_k(scores, k=None):
+    '''
+    Indices of the k highest scores along the last axis, best first (all of them if k is None)
+    '''
+    if k is None or k >= scores.shape[-1]:
+        return np.argsort(-scores, axis=-1)
+
+    top = np.argpartition(-scores, max(k - 1, 0), axis=-1)[..., :k]
+    return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=-1), axis=-1), axis=-1)
+
+
+class IdMap:
+    '''
+    Mapping of database IDs to model indices, kept as sorted arrays for vectorized lookups
+    '''
+    def __init__(self, ids, order=None, sorted_ids=None):
+        # Database IDs ordered by model index
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.order = np.argsort(self.ids, kind='mergesort') if order is None else order
+        self.sorted_ids = self.ids[self.order] if sorted_ids is None else sorted_ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def __contains__(self, id):
+        position = np.searchsorted(self.sorted_ids, id)
+        return position < len(self.sorted_ids) and self.sorted_ids[position] == id
+
+    def __getitem__(self, id):
+        position = np.searchsorted(self.sorted_ids, id)
+        if position == len(self.sorted_ids) or self.sorted_ids[position] != id:
+            raise KeyError(id)
+        return int(self.order[position])
+
+    def positions(self, ids):
+        '''
+        Model indices of ids, -1 for unknown IDs
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(self.sorted_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+
+        positions = np.minimum(np.searchsorted(self.sorted_ids, ids), len(self.sorted_ids) - 1)
+        return np.where(self.sorted_ids[positions] == ids, self.order[positions], -1)
+
+    def lookup(self, ids):
+        '''
+        Model indices of those of ids that are known, unknown IDs are dropped
+        '''
+        positions = self.positions(ids)
+        return positions[positions >= 0]
+
+    def extend(self, ids):
+        '''
+        New map with ids appended after the existing model indices
+        '''
+        return IdMap(np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)]))
+
+    def save(self, path, name):
+        for attr in ('ids', 'order', 'sorted_ids'):
+            np.save(os.path.join(path, '{}_{}.npy'.format(name, attr)), getattr(self, attr))
+
+    @classmethod
+    def load(cls, path, name, mmap_mode=None):
+        return cls(*(np.load(os.path.join(path, '{}_{}.npy'.format(name, attr)), mmap_mode=mmap_mode)
+                     for attr in ('ids', 'order', 'sorted_ids')))
 
 
 class PositiveRecommender:
@@ -26,7 +117,8 @@ class PositiveRecommender:
                          place_ids if place_ids else (place.id for place in models.Place.query.distinct()))
 
         self.user_model_map = self.dataset.mapping()[0]
-        self.model_place_map = {v: k for k, v in self.dataset.mapping()[2].items()}
+        self.place_model_map = self.dataset.mapping()[2]
+        self.model_place_map = {v: k for k, v in self.place_model_map.items()}
 
         self.n_places = self.dataset.interactions_shape()[1]
 
@@ -54,15 +146,15 @@ class PositiveRecommender:
         if save:
             self.save()
 
-    def recommend(self, user_id, filter_place_ids=None):
+    def recommend(self, user_id, filter_place_ids=None, k=None):
         if not filter_place_ids:
             model_place_ids = np.arange(self.n_places)
         else:
-            model_place_ids = [self.place_model_map[id] for id in filter_place_ids]
+            model_place_ids = np.array([self.place_model_map[id] for id in filter_place_ids])
 
         model_user_id = self.user_model_map[user_id]
         scores = self.model.predict(model_user_id, model_place_ids)
-        places_ranking = self.place_ids[model_place_ids[np.argsort(-scores)]]
+        places_ranking = self.place_ids[model_place_ids[top_k(scores, k)]]
 
         return places_ranking
 
@@ -75,6 +167,94 @@ class PositiveRecommender:
             self.__dict__.update(pickle.load(f))
 
 
+def stream_array(query, n_columns, chunk_size=LOADER_CHUNK_SIZE):
+    '''
+    Rows of an integer column query as an (n, n_columns) array, fetched through a server-side
+    cursor in chunks and copied straight into a preallocated array
+    '''
+    data = np.empty((query.count(), n_columns), dtype=np.int64)
+    rows = iter(query.yield_per(chunk_size))
+    size = 0
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+
+        # Rows inserted after the count was taken
+        if size + len(chunk) > len(data):
+            data = np.concatenate([data, np.empty((size + len(chunk) - len(data), n_columns), dtype=np.int64)])
+
+        data[size:size + len(chunk)] = chunk
+        size += len(chunk)
+
+    return data[:size]
+
+
+def load_reviews(chunk_size=LOADER_CHUNK_SIZE):
+    '''
+    (user_id, place_id, rating, modified) of every rated review, without hydrating Review objects
+    '''
+    query = db.session.query(models.Review.user_id, models.Review.place_id, models.Review.rating,
+                             models.Review.modified)\
+                      .filter(models.Review.user_id.isnot(None),
+                              models.Review.place_id.isnot(None),
+                              models.Review.rating.isnot(None))
+    return stream_array(query, 4, chunk_size)
+
+
+def current_version(directory=ARTIFACT_DIR):
+    try:
+        with open(os.path.join(directory, 'CURRENT')) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _save_model(model, path, name):
+    for attr in LIGHTFM_ARRAYS:
+        np.save(os.path.join(path, '{}_{}.npy'.format(name, attr)), getattr(model, attr))
+
+    return {param: value for param, value in model.get_params().items() if param != 'random_state'}
+
+
+def _load_model(params, path, name, mmap_mode=None):
+    model = LightFM(**params)
+    for attr in LIGHTFM_ARRAYS:
+        setattr(model, attr, np.load(os.path.join(path, '{}_{}.npy'.format(name, attr)), mmap_mode=mmap_mode))
+
+    return model
+
+
+def _grow_model(model, kind, n):
+    '''
+    Append n rows for new users or items (kind) to a trained LightFM model, embeddings drawn
+    around the mean of the trained ones the way LightFM initialises them, biases at the mean
+    '''
+    embeddings = getattr(model, kind + '_embeddings')
+    biases = getattr(model, kind + '_biases')
+    if embeddings is None:
+        return
+
+    mean_embedding = embeddings.mean(axis=0) if len(embeddings) else 0
+    mean_bias = biases.mean() if len(biases) else 0
+    new_embeddings = mean_embedding + (model.random_state.rand(n, model.no_components) - 0.5) / model.no_components
+    # LightFM starts adagrad accumulators at one, adadelta ones at zero
+    initial_gradient = 1 if model.learning_schedule == 'adagrad' else 0
+
+    grown = {
+        '_embeddings': new_embeddings,
+        '_embedding_gradients': np.full((n, model.no_components), initial_gradient),
+        '_embedding_momentum': np.zeros((n, model.no_components)),
+        '_biases': np.full(n, mean_bias),
+        '_bias_gradients': np.full(n, initial_gradient),
+        '_bias_momentum': np.zeros(n)
+    }
+    for suffix, rows in grown.items():
+        attr = kind + suffix
+        setattr(model, attr, np.concatenate([getattr(model, attr), rows.astype(np.float32)]))
+
+
 class CombinedRecommender:
     def __init__(self,
                  positive_loss=LIGHTFM_LOSS,
@@ -89,38 +269,92 @@ class CombinedRecommender:
         self.positive_model = LightFM(loss=positive_loss, no_components=positive_n_components)
         self.negative_model = LightFM(loss=negative_loss, no_components=negative_n_components)
 
-        self.update_dataset(user_ids, place_ids)
+        if user_ids is not None and place_ids is not None:
+            self.update_dataset(user_ids, place_ids)
+        else:
+            # Mappings are filled by fit() or load(), constructing a recommender never touches the database
+            self.user_model_map = IdMap([])
+            self.place_model_map = IdMap([])
+            self.n_places = 0
+            self.place_ids = self.place_model_map.ids
 
         self.positive_epochs = positive_epochs
         self.negative_epochs = negative_epochs
+        self.version = None
+        # Highest Review.modified the models have been trained on, and the ones trained on in the
+        # LAG_WINDOW below it (see mark_trained)
+        self.trained_until = None
+        self.trained_recent = np.empty(0, dtype=np.int64)
 
     def update_dataset(self, user_ids=None, place_ids=None):
-        self.dataset = Dataset()
-        self.dataset.fit(user_ids if user_ids else (user.id for user in models.User.query.distinct()),
-                         place_ids if place_ids else (place.id for place in models.Place.query.distinct()))
-
-        self.user_model_map = self.dataset.mapping()[0]
-        self.place_model_map = self.dataset.mapping()[2]
-        self.model_place_map = {v: k for k, v in self.place_model_map.items()}
-
-        self.n_places = self.dataset.interactions_shape()[1]
-
-        # Construct array of places database IDs, with indices indicating the place's index in the dataset
-        self.place_ids = np.array([self.model_place_map.get(i) for i in range(self.n_places)])
+        self.user_model_map = IdMap(user_ids if user_ids is not None else
+                                    stream_array(db.session.query(models.User.id), 1)[:, 0])
+        self.place_model_map = IdMap(place_ids if place_ids is not None else
+                                     stream_array(db.session.query(models.Place.id), 1)[:, 0])
+
+        self.n_places = len(self.place_model_map)
+
+        # Places database IDs, with indices indicating the place's index in the dataset
+        self.place_ids = self.place_model_map.ids
+
+    def grow(self, user_ids=(), place_ids=()):
+        '''
+        Map users and places the model has not seen yet, so that fit_partial can train on
+        their reviews without a full refit. Models are grown in place, so the recommender
+        must have been fitted or loaded with mmap_mode=None
+        '''
+        new_user_ids = np.setdiff1d(np.asarray(user_ids, dtype=np.int64), self.user_model_map.ids)
+        new_place_ids = np.setdiff1d(np.asarray(place_ids, dtype=np.int64), self.place_model_map.ids)
+
+        if len(new_user_ids):
+            self.user_model_map = self.user_model_map.extend(new_user_ids)
+            for model in (self.positive_model, self.negative_model):
+                _grow_model(model, 'user', len(new_user_ids))
+
+        if len(new_place_ids):
+            self.place_model_map = self.place_model_map.extend(new_place_ids)
+            for model in (self.positive_model, self.negative_model):
+                _grow_model(model, 'item', len(new_place_ids))
+
+            self.n_places = len(self.place_model_map)
+            self.place_ids = self.place_model_map.ids
+
+    def build_interactions(self, user_ids, place_ids, ratings):
+        '''
+        Positive interactions, negative interactions and negative weights as COO matrices,
+        skipping reviews of users or places unknown to the model
+        '''
+        rows = self.user_model_map.positions(user_ids)
+        cols = self.place_model_map.positions(place_ids)
+        ratings = np.asarray(ratings, dtype=np.float32)
+
+        known = (rows >= 0) & (cols >= 0)
+        positive = known & (ratings > 4)
+        negative = known & (ratings <= 4)
+        shape = (len(self.user_model_map), self.n_places)
+
+        positive_interactions = coo_matrix((np.ones(positive.sum(), dtype=np.float32),
+                                            (rows[positive], cols[positive])), shape=shape)
+        negative_interactions = coo_matrix((np.ones(negative.sum(), dtype=np.float32),
+                                            (rows[negative], cols[negative])), shape=shape)
+        negative_weights = coo_matrix((5 - ratings[negative], (rows[negative], cols[negative])), shape=shape)
+
+        return positive_interactions, negative_interactions, negative_weights
 
     def fit(self, reviews=None, save=True):
-        if not reviews:
-            positive_reviews = models.Review.query.filter(models.Review.rating > 4)
-            negative_reviews = models.Review.query.filter(models.Review.rating <= 4)
-
         self.update_dataset()
 
-        positive_interactions, _ = self.dataset.build_interactions(((review.user_id, review.place_id)
-                                                                    for review in positive_reviews))
+        if reviews is None:
+            reviews = load_reviews()
+            self.trained_until = 0
+            self.trained_recent = np.empty(0, dtype=np.int64)
+            self.mark_trained(reviews[:, 3])
+        else:
+            reviews = np.array([(review.user_id, review.place_id, review.rating) for review in reviews],
+                               dtype=np.int64).reshape(-1, 3)
 
-        negative_interactions, negative_weights =\
-            self.dataset.build_interactions(((review.user_id, review.place_id, 5 - review.rating)
-                                             for review in negative_reviews))
+        positive_interactions, negative_interactions, negative_weights =\
+            self.build_interactions(reviews[:, 0], reviews[:, 1], reviews[:, 2])
 
         self.positive_model.fit(positive_interactions, epochs=self.positive_epochs)
         self.negative_model.fit(negative_interactions, sample_weight=negative_weights,
@@ -129,14 +363,34 @@ class CombinedRecommender:
         if save:
             self.save()
 
-    def fit_partial(self, reviews, save=True):
-        positive_interactions, _ =\
-            self.dataset.build_interactions(((review.user_id, review.place_id)
-                                             for review in reviews if review.rating > 4))
+    def mark_trained(self, modified, window=LAG_WINDOW):
+        '''
+        Record the Review.modified numbers of reviews trained on. Numbers are drawn when a statement
+        runs but become visible when its transaction commits, so a review can show up after higher
+        numbers have been trained on. The numbers within window below trained_until are kept so that
+        untrained() can tell such late reviews from the ones already trained on
+        '''
+        modified = np.asarray(modified, dtype=np.int64)
+        if len(modified):
+            self.trained_until = max(self.trained_until or 0, int(modified.max()))
+
+        low = (self.trained_until or 0) - window
+        recent = np.union1d(self.trained_recent, modified[modified > low])
+        self.trained_recent = recent[recent > low]
+
+    def untrained(self, reviews):
+        '''
+        Those of reviews (with a modified attribute) that have not been trained on
+        '''
+        reviews = list(reviews)
+        trained = np.isin([review.modified for review in reviews], self.trained_recent)
+        return [review for review, seen in zip(reviews, trained) if not seen]
 
-        negative_interactions, negative_weights =\
-            self.dataset.build_interactions(((review.user_id, review.place_id, 5 - review.rating)
-                                             for review in reviews if review.rating <= 4))
+    def fit_partial(self, reviews, save=True):
+        positive_interactions, negative_interactions, negative_weights =\
+            self.build_interactions([review.user_id for review in reviews],
+                                    [review.place_id for review in reviews],
+                                    [review.rating for review in reviews])
 
         self.positive_model.fit_partial(positive_interactions, epochs=self.positive_epochs)
         self.negative_model.fit_partial(negative_interactions, sample_weight=negative_weights,
@@ -145,23 +399,128 @@ class CombinedRecommender:
         if save:
             self.save()
 
-    def recommend(self, user_id, filter_place_ids=None):
-        if not filter_place_ids:
-            model_place_ids = np.arange(self.n_places)
-        else:
-            model_place_ids = np.array([self.place_model_map[id] for id in filter_place_ids])
+    def _scores(self, model_user_ids, model_place_ids=None):
+        '''
+        Positive to negative score ratio for the given users and places, computed from the
+        embeddings directly (as LightFM.predict does) so that memory-mapped models can serve
+        '''
+        scores = []
+        for model in (self.positive_model, self.negative_model):
+            item_embeddings, item_biases = model.item_embeddings, model.item_biases
+            if model_place_ids is not None:
+                item_embeddings, item_biases = item_embeddings[model_place_ids], item_biases[model_place_ids]
+
+            scores.append(model.user_embeddings[model_user_ids] @ item_embeddings.T +
+                          model.user_biases[model_user_ids][..., np.newaxis] + item_biases)
+
+        return scores[0] / scores[1]
+
+    def recommend(self, user_id, filter_place_ids=None, k=None):
+        model_place_ids = None
+        if filter_place_ids is not None:
+            model_place_ids = self.place_model_map.lookup(filter_place_ids)
 
         model_user_id = self.user_model_map[user_id]
-        positive_scores = self.positive_model.predict(model_user_id, model_place_ids)
-        negative_scores = self.negative_model.predict(model_user_id, model_place_ids)
-        places_ranking = self.place_ids[model_place_ids[np.argsort(-positive_scores / negative_scores)]]
+        if model_place_ids is not None and len(model_place_ids) == 0:
+            return self.place_ids[:0]
 
-        return places_ranking
+        top = top_k(self._scores(model_user_id, model_place_ids), k)
+        places_ranking = self.place_ids[top if model_place_ids is None else model_place_ids[top]]
 
-    def save(self, filename=COMBINED_FILENAME):
-        with open(filename, 'wb') as f:
-            pickle.dump(self.__dict__, f, 2)
+        return places_ranking
 
-    def load(self, filename=COMBINED_FILENAME):
-        with open(filename, 'rb') as f:
-            self.__dict__.update(pickle.load(f))
+    def recommend_batch(self, user_ids, k, filter_place_ids=None, chunk_size=RECOMMEND_BATCH_CHUNK_SIZE):
+        '''
+        Top k places for each of user_ids as a (len(user_ids), k) array of place IDs,
+        scoring chunk_size users at a time with one matrix product per model
+        '''
+        model_user_ids = np.array([self.user_model_map[id] for id in user_ids], dtype=np.int32)
+        if filter_place_ids is None:
+            model_place_ids = np.arange(self.n_places)
+        else:
+            model_place_ids = self.place_model_map.lookup(filter_place_ids)
+
+        k = min(k, len(model_place_ids))
+        rankings = np.empty((len(model_user_ids), k), dtype=self.place_ids.dtype)
+        if k == 0:
+            return rankings
+
+        for start in range(0, len(model_user_ids), chunk_size):
+            chunk = model_user_ids[start:start + chunk_size]
+            top = top_k(self._scores(chunk, None if filter_place_ids is None else model_place_ids), k)
+            rankings[start:start + len(chunk)] = self.place_ids[model_place_ids[top]]
+
+        return rankings
+
+    def save(self, directory=ARTIFACT_DIR, keep=ARTIFACT_KEEP):
+        '''
+        Write a new artifact version and point CURRENT at it. Both steps are renames,
+        so readers only ever see complete versions
+        '''
+        os.makedirs(directory, exist_ok=True)
+        version = '{}-{}'.format(time.strftime('%Y%m%d%H%M%S'), os.urandom(4).hex())
+
+        tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=directory)
+        try:
+            manifest = {
+                'format': ARTIFACT_FORMAT,
+                'version': version,
+                'positive_params': _save_model(self.positive_model, tmp_path, 'positive'),
+                'negative_params': _save_model(self.negative_model, tmp_path, 'negative'),
+                'positive_epochs': self.positive_epochs,
+                'negative_epochs': self.negative_epochs,
+                'trained_until': self.trained_until
+            }
+            self.user_model_map.save(tmp_path, 'users')
+            self.place_model_map.save(tmp_path, 'places')
+            np.save(os.path.join(tmp_path, 'trained_recent.npy'), self.trained_recent)
+
+            with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f)
+
+            os.rename(tmp_path, os.path.join(directory, version))
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        fd, current_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            f.write(version)
+        os.replace(current_path, os.path.join(directory, 'CURRENT'))
+        self.version = version
+
+        # Old versions can go even if a worker still maps them, open mappings outlive the unlink
+        versions = sorted(name for name in os.listdir(directory)
+                          if not name.startswith('.') and name != 'CURRENT')
+        for name in versions[:-keep]:
+            if name != version:
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    def load(self, directory=ARTIFACT_DIR, mmap_mode='r'):
+        '''
+        Load the current version. The default read-only memory maps let serving processes share one
+        copy of the arrays through the page cache, training needs mmap_mode=None for writable ones
+        '''
+        version = current_version(directory)
+        if version is None:
+            raise FileNotFoundError('No saved recommender in {}'.format(directory))
+        path = os.path.join(directory, version)
+
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest['format'] != ARTIFACT_FORMAT:
+            raise ValueError('Unsupported recommender artifact format {}'.format(manifest['format']))
+
+        self.positive_model = _load_model(manifest['positive_params'], path, 'positive', mmap_mode)
+        self.negative_model = _load_model(manifest['negative_params'], path, 'negative', mmap_mode)
+        self.positive_epochs = manifest['positive_epochs']
+        self.negative_epochs = manifest['negative_epochs']
+        self.trained_until = manifest.get('trained_until')
+        recent_path = os.path.join(path, 'trained_recent.npy')
+        self.trained_recent = np.load(recent_path) if os.path.exists(recent_path) else np.empty(0, dtype=np.int64)
+
+        self.user_model_map = IdMap.load(path, 'users', mmap_mode)
+        self.place_model_map = IdMap.load(path, 'places', mmap_mode)
+        self.n_places = len(self.place_model_map)
+        self.place_ids = self.place_model_map.ids
+        self.version = version
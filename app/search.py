@@ -0,0 +1,104 @@
+from app import app, db
+from .models import Place
+from .snapshot import Snapshot
+from sqlalchemy import func
+import unicodedata
+import bisect
+import re
+
+
+def _contains_pattern(name):
+    escaped = name.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%' + escaped + '%'
+
+
+def search_places(name, offset=0, limit=app.config['SEARCH_PAGE_SIZE']):
+    '''
+    Query for places with name in their name, most similar first. The ILIKE filter is served by
+    the ix_place_name_trgm index and the page is cut in SQL, capped at MAX_SEARCH_PAGE_SIZE
+    '''
+    limit = max(0, min(limit, app.config['MAX_SEARCH_PAGE_SIZE']))
+
+    return Place.query.filter(Place.name.ilike(_contains_pattern(name), escape='\\'))\
+                      .order_by(func.similarity(Place.name, name).desc(),
+                                Place.rating.desc().nullslast(),
+                                Place.id)\
+                      .offset(max(offset, 0)).limit(limit)
+
+
+# Latin spelling of Russian letters, so that names can be completed from either alphabet
+TRANSLITERATION = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'kh', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'shch', 'ъ': '',
+    'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya'
+})
+
+NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    '''
+    Case-folded text without diacritics (ё becomes е) or punctuation, words separated by single spaces
+    '''
+    # Case-folded after the decomposition, which can produce capitals (№ becomes No)
+    text = unicodedata.normalize('NFKD', text).casefold()
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return NON_WORD.sub(' ', text).strip()
+
+
+class AutocompleteIndex(Snapshot):
+    '''
+    Sorted in-memory array of normalized place name keys for prefix lookups. Every word of a name
+    starts a key, in the original spelling and transliterated to Latin
+    '''
+    def __init__(self, ttl=app.config['AUTOCOMPLETE_TTL']):
+        super().__init__(ttl)
+
+    @staticmethod
+    def _keys(name):
+        normalized = normalize(name)
+        keys = set()
+        for spelling in (normalized, normalized.translate(TRANSLITERATION)):
+            keys.add(spelling)
+            keys.update(spelling[match.start():] for match in re.finditer(' ', spelling))
+
+        return {key.strip() for key in keys if key.strip()}
+
+    def build(self):
+        # Rebuilt after ttl to pick up places imported or created by other processes
+        places = db.session.query(Place.id, Place.name).filter(Place.name.isnot(None)).all()
+        return sorted((key, id, name) for id, name in places for key in self._keys(name))
+
+    def add(self, id, name):
+        if name is None:
+            return
+
+        with self.lock:
+            if self.data is None:
+                return
+            for key in self._keys(name):
+                bisect.insort(self.data, (key, id, name))
+
+    def complete(self, prefix, limit=app.config['AUTOCOMPLETE_LIMIT']):
+        '''
+        Up to limit (id, name) pairs of places with a word starting with prefix, in key order
+        '''
+        entries = self.current()
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        results = []
+        seen = set()
+        position = bisect.bisect_left(entries, (prefix,))
+        while position < len(entries) and len(results) < limit:
+            key, id, name = entries[position]
+            if not key.startswith(prefix):
+                break
+            if id not in seen:
+                seen.add(id)
+                results.append((id, name))
+            position += 1
+
+        return results
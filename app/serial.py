@@ -1,5 +1,19 @@
 from .models import User, Place, Review
-from shapely import wkb
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_json(obj):
+    '''
+    Compact JSON text, encoded with orjson when it is installed
+    '''
+    if orjson is not None:
+        return orjson.dumps(obj).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
 
 
 def serialize(obj):
@@ -19,15 +33,11 @@ def _serialize_user(obj):
 
 
 def _serialize_place(obj):
-    point = None
-    if obj.location is not None:
-        point = wkb.loads(bytes(obj.location.data))
-
     return {
         'id': obj.id,
         'name': obj.name,
         'address': obj.address,
-        'location': (point.y, point.x) if point else None,
+        'location': (obj.latitude, obj.longitude) if obj.latitude is not None else None,
         'place_type': obj.place_type,
         'tripadvisor_url': obj.tripadvisor_url,
         'navicontainer': obj.navicontainer,
@@ -37,11 +47,27 @@ def _serialize_place(obj):
     }
 
 
-def _serialize_review(obj):
+def _review_fields(obj):
     return {
         'id': obj.id,
         'user_id': obj.user_id,
         'place_id': obj.place_id,
-        'place': _serialize_place(Place.query.get(obj.place_id)) if obj.place_id else None,
         'rating': obj.rating,
     }
+
+
+def _serialize_review(obj, place=None):
+    # Callers listing many reviews should eager-load Review.place (or pass place) to avoid a query per review
+    if place is None and obj.place_id:
+        place = obj.place
+
+    payload = _review_fields(obj)
+    payload['place'] = _serialize_place(place) if place is not None else None
+    return payload
+
+
+def encode_review(obj, place_fragment=None):
+    '''
+    JSON of a serialized review with its place spliced in from an already encoded fragment
+    '''
+    return encode_json(_review_fields(obj))[:-1] + ',"place":' + (place_fragment or 'null') + '}'
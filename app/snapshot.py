@@ -0,0 +1,38 @@
+import threading
+import time
+
+
+class Snapshot:
+    '''
+    Data loaded from the database into memory (data), rebuilt once it is older than ttl seconds.
+    Subclasses load it in build(). Only the first build happens in a request, RecommenderLoader's
+    thread calls refresh_if_stale() afterwards, so requests never wait for a rebuild
+    '''
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.data = None
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def build(self):
+        raise NotImplementedError
+
+    def refresh(self):
+        self.data = self.build()
+        self.loaded_at = time.monotonic()
+
+    def current(self):
+        if self.data is None:
+            with self.lock:
+                if self.data is None:
+                    self.refresh()
+        return self.data
+
+    def refresh_if_stale(self, max_age=None):
+        '''
+        Rebuild if built more than max_age (ttl by default) seconds ago. Nothing is built before the first request
+        '''
+        max_age = self.ttl if max_age is None else max_age
+        if self.data is not None and time.monotonic() - self.loaded_at > max_age:
+            with self.lock:
+                self.refresh()
@@ -0,0 +1,97 @@
+from app import app, db, models
+from .snapshot import Snapshot
+from collections import namedtuple
+import numpy as np
+
+
+EARTH_RADIUS = 6371008.8
+METERS_PER_DEGREE = np.pi * EARTH_RADIUS / 180
+
+PlaceSnapshot = namedtuple('PlaceSnapshot', ['ids', 'lat', 'lon', 'place_types', 'cells'])
+
+
+def haversine(lat, lon, lats, lons):
+    lat, lon, lats, lons = map(np.radians, (lat, lon, lats, lons))
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+class PlaceIndex(Snapshot):
+    '''
+    In-process grid index over place coordinates and types, used to pick recommendation candidates
+    '''
+    def __init__(self,
+                 cell_size=app.config['PLACE_INDEX_CELL_SIZE'],
+                 ttl=app.config['PLACE_INDEX_TTL']):
+        super().__init__(ttl)
+        self.cell_size = cell_size
+
+    def _cell(self, lat, lon):
+        return int(np.floor(lat / self.cell_size)), int(np.floor(lon / self.cell_size))
+
+    def _build(self, ids, lats, lons, place_types):
+        ids = np.array(ids, dtype=np.int64)
+        lats = np.array(lats, dtype=np.float64)
+        lons = np.array(lons, dtype=np.float64)
+        place_types = np.array(place_types, dtype=np.int16)
+
+        cells = {}
+        for row in np.flatnonzero(~np.isnan(lats)).tolist():
+            cells.setdefault(self._cell(lats[row], lons[row]), []).append(row)
+
+        return PlaceSnapshot(ids, lats, lons, place_types,
+                             {key: np.array(rows, dtype=np.int64) for key, rows in cells.items()})
+
+    def build(self):
+        rows = db.session.query(models.Place.id, models.Place.latitude, models.Place.longitude,
+                                models.Place.place_type).all()
+
+        return self._build([row[0] for row in rows],
+                           [np.nan if row[1] is None else row[1] for row in rows],
+                           [np.nan if row[2] is None else row[2] for row in rows],
+                           [-1 if row[3] is None else row[3] for row in rows])
+
+    def add(self, place_id, lat=None, lon=None, place_type=None):
+        with self.lock:
+            snapshot = self.data
+            if snapshot is None:
+                return
+
+            self.data = self._build(
+                np.append(snapshot.ids, place_id),
+                np.append(snapshot.lat, np.nan if lat is None else lat),
+                np.append(snapshot.lon, np.nan if lon is None else lon),
+                np.append(snapshot.place_types, -1 if place_type is None else place_type))
+
+    def _within(self, snapshot, lat, lon, radius):
+        lat_delta = radius / METERS_PER_DEGREE
+        lon_delta = lat_delta / np.cos(np.radians(min(abs(lat) + lat_delta, 89.0)))
+
+        min_cell = self._cell(lat - lat_delta, lon - lon_delta)
+        max_cell = self._cell(lat + lat_delta, lon + lon_delta)
+        candidates = [snapshot.cells[(i, j)]
+                      for i in range(min_cell[0], max_cell[0] + 1)
+                      for j in range(min_cell[1], max_cell[1] + 1)
+                      if (i, j) in snapshot.cells]
+        if not candidates:
+            return np.empty(0, dtype=np.int64)
+
+        rows = np.concatenate(candidates)
+        rows = rows[haversine(lat, lon, snapshot.lat[rows], snapshot.lon[rows]) <= radius]
+        return np.sort(rows)
+
+    def query(self, lat=None, lon=None, radius=None, place_type=None):
+        '''
+        IDs of places within radius meters of (lat, lon) and of place_type, each filter applied if given
+        '''
+        snapshot = self.current()
+
+        if lat is not None and lon is not None and radius:
+            rows = self._within(snapshot, lat, lon, radius)
+        else:
+            rows = np.arange(len(snapshot.ids))
+
+        if place_type is not None:
+            rows = rows[snapshot.place_types[rows] == place_type]
+
+        return snapshot.ids[rows]
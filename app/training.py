@@ -0,0 +1,173 @@
+from app import app, db, models
+from .recommender import CombinedRecommender, current_version, LAG_WINDOW
+from collections import namedtuple
+import threading
+import time
+
+
+ReviewRecord = namedtuple('ReviewRecord', ['user_id', 'place_id', 'rating'])
+TrainingReview = namedtuple('TrainingReview', ['modified', 'user_id', 'place_id', 'rating'])
+
+
+class TrainingWorker:
+    '''
+    The only process that trains the recommender, run with `flask recommender worker`.
+    Reads the ratings changed since the last batch from the database by Review.modified, trains on
+    them and saves new artifact versions, which the web processes pick up with RecommenderLoader
+    '''
+    def __init__(self,
+                 batch_size=app.config['RECOMMENDER_BATCH_SIZE'],
+                 batch_wait=app.config['RECOMMENDER_BATCH_WAIT'],
+                 full_fit_interval=app.config['RECOMMENDER_FULL_FIT_INTERVAL'],
+                 save_interval=app.config['RECOMMENDER_SAVE_INTERVAL']):
+        self.recommender = None
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.full_fit_interval = full_fit_interval
+        self.save_interval = save_interval
+
+        self.last_full_fit = None
+        self.last_save = None
+        self.unsaved = False
+
+    def run(self):
+        while True:
+            try:
+                with app.app_context():
+                    more = self.train()
+            except Exception:
+                app.logger.exception('Recommender training failed')
+                more = False
+
+            if not more:
+                time.sleep(self.batch_wait)
+
+    def load(self):
+        '''
+        Load the saved recommender into memory to train it further, or fit one if there is none
+        '''
+        if current_version() is None:
+            self.fit()
+            return
+
+        recommender = CombinedRecommender()
+        recommender.load(mmap_mode=None)
+        self.recommender = recommender
+        self.last_full_fit = self.last_save = time.monotonic()
+        self.unsaved = False
+
+    def fit(self):
+        recommender = CombinedRecommender()
+        recommender.fit()
+        self.recommender = recommender
+        self.last_full_fit = self.last_save = time.monotonic()
+        self.unsaved = False
+
+    def collect(self):
+        '''
+        Changed reviews not trained on yet. The LAG_WINDOW below trained_until is read again for
+        reviews whose transactions committed after ones with higher modified numbers
+        '''
+        recommender = self.recommender
+        query = db.session.query(models.Review.modified, models.Review.user_id,
+                                 models.Review.place_id, models.Review.rating)\
+                          .filter(models.Review.modified > recommender.trained_until - LAG_WINDOW,
+                                  models.Review.user_id.isnot(None),
+                                  models.Review.place_id.isnot(None),
+                                  models.Review.rating.isnot(None))\
+                          .order_by(models.Review.modified)\
+                          .limit(self.batch_size + len(recommender.trained_recent))
+        return recommender.untrained(TrainingReview(*row) for row in query)
+
+    def train(self):
+        '''
+        One training round, returns whether more changed reviews may be waiting
+        '''
+        # A version saved by someone else, e.g. `flask recommender train` or an import, replaces ours.
+        # Its trained_until makes the next batches cover whatever it has not seen
+        if self.recommender is None or current_version() != self.recommender.version:
+            self.load()
+
+        if (self.recommender.trained_until is None or
+                time.monotonic() - self.last_full_fit > self.full_fit_interval):
+            self.fit()
+            return False
+
+        reviews = self.collect()
+        if reviews:
+            self.recommender.grow([review.user_id for review in reviews], [review.place_id for review in reviews])
+            self.recommender.fit_partial(reviews, save=False)
+            self.recommender.mark_trained([review.modified for review in reviews])
+            self.unsaved = True
+
+        # Saving writes every model array, so partial fits are batched into one version per interval
+        if self.unsaved and time.monotonic() - self.last_save > self.save_interval:
+            self.recommender.save()
+            self.last_save = time.monotonic()
+            self.unsaved = False
+
+        return len(reviews) >= self.batch_size
+
+
+class RecommenderLoader:
+    '''
+    Serves the recommender saved by the training worker, memory-mapped so that web processes share
+    its arrays through the page cache, and swaps in newer versions from a background thread.
+    recommender stays None until a version has been saved.
+    The same thread rebuilds the in-memory indexes (snapshots) once they are older than their TTL,
+    so requests never wait for a rebuild, and the popularity ranking after each training run that
+    saves a new version, at most every popularity_min_ttl seconds
+    '''
+    def __init__(self, cache=None, snapshots=(), popularity=None,
+                 reload_interval=app.config['RECOMMENDER_RELOAD_INTERVAL'],
+                 popularity_min_ttl=app.config['POPULARITY_MIN_TTL']):
+        self.recommender = None
+        self.cache = cache
+        self.snapshots = snapshots
+        self.popularity = popularity
+        self.reload_interval = reload_interval
+        self.popularity_min_ttl = popularity_min_ttl
+
+        self.thread = None
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        with self.start_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='recommender-loader', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            try:
+                loaded = self.load()
+            except Exception:
+                app.logger.exception('Recommender loading failed')
+                loaded = False
+
+            for snapshot in self.snapshots:
+                max_age = self.popularity_min_ttl if loaded and snapshot is self.popularity else None
+                try:
+                    with app.app_context():
+                        snapshot.refresh_if_stale(max_age)
+                except Exception:
+                    app.logger.exception('Refreshing %s failed', type(snapshot).__name__)
+
+            time.sleep(self.reload_interval)
+
+    def load(self):
+        '''
+        Load the current version if it is new, returns whether it was
+        '''
+        version = current_version()
+        if version is None or (self.recommender is not None and self.recommender.version == version):
+            return False
+
+        recommender = CombinedRecommender()
+        recommender.load()
+        self.recommender = recommender
+
+        if self.cache is not None:
+            self.cache.switch(recommender)
+
+        return True
@@ -1,13 +1,15 @@
-from . import app, models, db, recommender, login_manager
+from . import app, models, db, recommender_loader, recommendation_cache, place_cache, place_index, \
+    autocomplete_index, popularity_ranking, login_manager
 from flask import jsonify, abort, request, g
 from sqlalchemy import func
-from geoalchemy2 import func as geo
+from sqlalchemy.exc import IntegrityError
 from flask_login import current_user, login_user, logout_user, login_required
 from .models import Place, User, Review
-from .serial import serialize
+from .serial import serialize, encode_review, encode_json
+from .search import search_places
+from .training import ReviewRecord
 import requests
 from json import dumps
-from shapely import wkb
 
 
 PLACE_TYPES = {'restaurant': models.PLACE_RESTAURANT,
@@ -18,6 +20,10 @@ TYPE_IDS = {models.PLACE_RESTAURANT: 4,
             models.PLACE_BAR: 5,
             models.PLACE_CAFE: 6}
 
+# Ratings are TripAdvisor bubbles, training weighs negative ratings by 5 - rating
+MIN_RATING = 1
+MAX_RATING = 5
+
 
 @app.before_request
 def before_request():
@@ -27,6 +33,33 @@ def before_request():
     g.user = current_user
 
 
+@app.before_first_request
+def start_recommender_loader():
+    '''
+    Load the recommender in the background, /recommend falls back to popularity until it is ready.
+    Training happens in a separate process, see `flask recommender worker`
+    '''
+    recommender_loader.start()
+
+
+def json_fragments_response(fragments, as_list=False):
+    '''
+    Compact JSON response assembled from already encoded fragments, lists skip missing (None) fragments
+    '''
+    if as_list:
+        fragments = '[' + ','.join(fragment for fragment in fragments if fragment is not None) + ']'
+    return app.response_class(fragments, mimetype=app.config['JSONIFY_MIMETYPE'])
+
+
+def json_response(obj):
+    '''
+    Compact JSON response through the fast encoder, unlike jsonify this ignores debug pretty-printing
+    '''
+    if isinstance(obj, list):
+        return json_fragments_response(map(encode_json, obj), as_list=True)
+    return app.response_class(encode_json(obj), mimetype=app.config['JSONIFY_MIMETYPE'])
+
+
 @login_manager.user_loader
 def load_user(user_id):
     '''
@@ -37,10 +70,10 @@ def load_user(user_id):
 
 @app.route('/p/<int:id>')
 def get_place(id):
-    place = Place.query.get(id)
-    if place is None:
+    fragment, = place_cache.get_many([id])
+    if fragment is None:
         abort(404)
-    return jsonify(serialize(place))
+    return json_fragments_response(fragment)
 
 
 @app.route('/p/create')
@@ -57,31 +90,53 @@ def create_place():
                          location=location,
                          address=data.get('address'),
                          place_type=PLACE_TYPES.get(data.get('type')),
-                         tripadvisor_url=data.get('tripadvisor_url', '').split('/')[-1],
+                         tripadvisor_url=data.get('tripadvisor_url', '').split('/')[-1] or None,
                          navicontainer=data.get('navicontainer'),
                          naviaddress=data.get('naviaddress'))
     db.session.add(place)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'place_exists'})
+
+    place_index.add(place.id,
+                    float(data['lat']) if location else None,
+                    float(data['lon']) if location else None,
+                    place.place_type)
+    autocomplete_index.add(place.id, place.name)
+    place_cache.invalidate(place.id)
 
     return jsonify({'status': 'ok', 'id': place.id})
 
 
 @app.route('/p/search/<string:name>')
 def find_place(name):
-    places = Place.query.filter(Place.name.ilike('%' + name + '%')).all()
-    if len(places) < 1:
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', app.config['SEARCH_PAGE_SIZE'], type=int)
+
+    place_ids = [place_id for place_id, in search_places(name, offset, limit).with_entities(Place.id)]
+    if len(place_ids) < 1 and offset == 0:
         abort(404)
 
-    return jsonify([serialize(place) for place in places])
+    return json_fragments_response(place_cache.get_many(place_ids), as_list=True)
+
+
+@app.route('/p/autocomplete/<string:prefix>')
+def autocomplete_place(prefix):
+    limit = request.args.get('limit', app.config['AUTOCOMPLETE_LIMIT'], type=int)
+    limit = max(1, min(limit, app.config['MAX_AUTOCOMPLETE_LIMIT']))
+
+    return json_response([{'id': id, 'name': name} for id, name in autocomplete_index.complete(prefix, limit)])
 
 
 @app.route('/p/range/<int:start>/<int:stop>/<string:name>')
 def find_place_range(start, stop, name):
-    places = Place.query.filter(Place.name.ilike('%' + name + '%')).all()
-    if len(places) < 1:
+    place_ids = [place_id for place_id, in search_places(name, start, stop - start).with_entities(Place.id)]
+    if len(place_ids) < 1 and start == 0:
         abort(404)
 
-    return jsonify([serialize(place) for place in places][start:stop])
+    return json_fragments_response(place_cache.get_many(place_ids), as_list=True)
 
 
 @app.route('/u/<int:id>')
@@ -105,8 +160,17 @@ def get_reviews():
     if not g.user.is_authenticated:
         return jsonify({'error': 'authentication required'})
 
-    reviews = g.user.reviews.order_by(Review.rating.desc().nullslast()).all()
-    return jsonify(list(map(serialize, reviews)))
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', app.config['REVIEWS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, app.config['MAX_REVIEWS_PER_PAGE']))
+
+    reviews = g.user.reviews.order_by(Review.rating.desc().nullslast(), Review.id)\
+                            .limit(per_page).offset((page - 1) * per_page).all()
+    place_ids = list({review.place_id for review in reviews if review.place_id})
+    place_fragments = dict(zip(place_ids, place_cache.get_many(place_ids)))
+
+    return json_fragments_response([encode_review(review, place_fragments.get(review.place_id))
+                                    for review in reviews], as_list=True)
 
 
 @app.route('/register', methods=['POST'])
@@ -170,7 +234,7 @@ def get_current_user():
 
 @app.route('/recommend')
 def recommend():
-    if not g.user:
+    if not g.user.is_authenticated:
         return jsonify({'error': 'authentication required'})
 
     try:
@@ -180,70 +244,108 @@ def recommend():
         if radius > app.config['MAX_SEARCH_RADIUS']:
             radius = None
 
-    except ValueError:
+    except (TypeError, ValueError):
         lat = None
         lon = None
         radius = None
 
     place_type = PLACE_TYPES.get(request.args.get('type'))
 
-    if lat and lon and radius:
-        places = models.Place.query.filter(
-            geo.ST_DWithin(models.Place.location, 'POINT({} {})'.format(lon, lat), radius))
-    else:
-        places = models.Place.query
+    try:
+        limit = int(request.args.get('limit', app.config['RECOMMEND_LIMIT']))
+        limit = max(1, min(limit, app.config['MAX_RECOMMEND_LIMIT']))
+    except ValueError:
+        limit = app.config['RECOMMEND_LIMIT']
 
-    if place_type:
-        places = places.filter_by(place_type=place_type)
-    else:
-        places = places
+    filter_place_ids = None
+    if (lat and lon and radius) or place_type:
+        filter_place_ids = place_index.query(lat, lon, radius, place_type)
+
+    suggestions = None
+    recommender = recommender_loader.recommender
+    if recommender is not None:
+        try:
+            suggestions = recommendation_cache.recommend(recommender, g.user.id, filter_place_ids, k=limit)
+        except KeyError:
+            pass
+
+    if suggestions is None:
+        suggestions = popularity_ranking.recommend(filter_place_ids, limit)
+
+    # Fragments come back in ranking order, places missing from the cache are loaded with one query
+    return json_fragments_response(place_cache.get_many(list(map(int, suggestions))), as_list=True)
+
+
+@app.route('/rate', methods=['POST'])
+def rate_places():
+    if not g.user.is_authenticated:
+        return jsonify({'error': 'authentication required'})
 
+    json = request.get_json()
+    ratings = json.get('ratings') if isinstance(json, dict) else None
+    if not isinstance(ratings, list) or not ratings:
+        return jsonify({'error': 'invalid_json'})
+    if len(ratings) > app.config['MAX_BULK_RATINGS']:
+        return jsonify({'error': 'too_many_ratings'})
+
+    # Accept {"place_id": ..., "rating": ...} objects or [place_id, rating] pairs, the last rating of a place wins
+    place_ratings = {}
+    for item in ratings:
+        if isinstance(item, dict):
+            place_id, rating = item.get('place_id'), item.get('rating')
+        elif isinstance(item, list) and len(item) == 2:
+            place_id, rating = item
+        else:
+            return jsonify({'error': 'invalid_json'})
+
+        if not isinstance(place_id, int) or not isinstance(rating, int):
+            return jsonify({'error': 'not an int'})
+        if not MIN_RATING <= rating <= MAX_RATING:
+            return jsonify({'error': 'invalid_rating'})
+        place_ratings[place_id] = rating
+
+    reviews = [ReviewRecord(g.user.id, place_id, rating) for place_id, rating in place_ratings.items()]
     try:
-        suggestions = recommender.recommend(g.user.id, (place.id for place in places))[:20]
-    except KeyError:
-        return jsonify(list(map(serialize, places.order_by(models.Place.rating.desc().nullslast()).all()[:20])))
+        models.upsert_reviews([review._asdict() for review in reviews])
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'unknown_place'})
+
+    # The training worker picks the ratings up from the database
+    recommendation_cache.invalidate(g.user.id)
 
-    return jsonify(list(map(serialize, Place.query.filter(Place.id.in_(list(map(int, suggestions)))).all())))
+    return jsonify({'status': 'ok', 'count': len(reviews)})
 
 
 @app.route('/rate/<int:id>', methods=['POST'])
 def rate_place(id):
-    if not g.user:
+    if not g.user.is_authenticated:
         return jsonify({'error': 'authentication required'})
 
     json = request.get_json()
     rating = json['rating']
     if not isinstance(rating, int):
         return jsonify({'error': 'not an int'})
+    if not MIN_RATING <= rating <= MAX_RATING:
+        return jsonify({'error': 'invalid_rating'})
 
-    first_review = False
-    if g.user.reviews.count() == 0:
-        first_review = True
-
-    review = Review.query.filter_by(user_id=g.user.id, place_id=id).first()
-    if not review:
-        review = Review(user_id=g.user.id, place_id=id)
-        db.session.add(review)
+    review = ReviewRecord(g.user.id, id, rating)
+    try:
+        models.upsert_reviews([review._asdict()])
         db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'unknown_place'})
 
-    review.rating = rating
-    db.session.commit()
-
-    if first_review:
-        recommender.fit()
-    else:
-        recommender.fit_partial([review])
+    recommendation_cache.invalidate(g.user.id)
 
     return jsonify({'status': 'ok'})
 
 
 def create_naviaddress(place, default_lang=app.config['NAVIADDRESS_DEFAULT_LANG'], address_type='free'):
-    point = None
-    if place.location is not None:
-        point = wkb.loads(bytes(place.location.data))
-
-    data = {'lat': float(point.y),
-            'lon': float(point.x),
+    data = {'lat': place.latitude,
+            'lon': place.longitude,
             'default_lang': default_lang,
             'address_type': address_type}
 
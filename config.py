@@ -1,3 +1,5 @@
+import os
+
 host = 'localhost'
 port = 8000
 debug = True
@@ -19,3 +21,52 @@ BOT_EMAIL = '***REMOVED***'
 BOT_PASSWORD = '***REMOVED***'
 
 MAX_SEARCH_RADIUS = 10000
+SEARCH_PAGE_SIZE = 50
+MAX_SEARCH_PAGE_SIZE = 100
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 50
+AUTOCOMPLETE_TTL = 10 * 60
+RECOMMEND_LIMIT = 20
+MAX_RECOMMEND_LIMIT = 100
+REVIEWS_PER_PAGE = 50
+MAX_REVIEWS_PER_PAGE = 200
+MAX_BULK_RATINGS = 100
+
+PLACE_INDEX_CELL_SIZE = 0.02
+PLACE_INDEX_TTL = 10 * 60
+
+PLACE_CACHE_SIZE = 50000
+# Shared second tier with the werkzeug cache interface, e.g. werkzeug.contrib.cache.RedisCache().
+# Needed for places updated by other processes (e.g. `flask tripadvisor import`) to show up at once,
+# otherwise web processes serve their own copies for up to PLACE_CACHE_LOCAL_TTL
+PLACE_CACHE_BACKEND = None
+PLACE_CACHE_TIMEOUT = 24 * 60 * 60
+PLACE_CACHE_LOCAL_TTL = 5 * 60
+
+JSONIFY_PRETTYPRINT_REGULAR = False
+
+RECOMMENDER_BATCH_SIZE = 10000
+RECOMMENDER_BATCH_WAIT = 5
+RECOMMENDER_FULL_FIT_INTERVAL = 6 * 60 * 60
+RECOMMENDER_SAVE_INTERVAL = 60
+# Review.modified numbers below the last one trained on that the worker reads again, for reviews of
+# transactions that committed late. Should exceed the reviews written while a transaction is open,
+# an import batch writes up to IMPORT_BATCH_SIZE
+RECOMMENDER_LAG_WINDOW = 20000
+RECOMMENDER_RELOAD_INTERVAL = 60
+# Absolute, so that processes started elsewhere (e.g. the scrapy import) share the same artifacts
+RECOMMENDER_ARTIFACT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recommender')
+RECOMMENDER_ARTIFACT_KEEP = 3
+
+RECOMMENDATION_CACHE_SIZE = 10000
+RECOMMENDATION_CACHE_DEPTH = 1000
+RECOMMENDATION_CACHE_DIR = None
+
+POPULARITY_COUNT_WEIGHT = 1.0
+POPULARITY_RECENCY_WEIGHT = 0.5
+POPULARITY_TTL = 60 * 60
+# New recommender versions refresh the ranking once it is older than this
+POPULARITY_MIN_TTL = 5 * 60
+
+# Places, users and reviews buffered by the TripAdvisor import before they are written
+IMPORT_BATCH_SIZE = 5000
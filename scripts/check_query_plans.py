@@ -0,0 +1,129 @@
+'''
+EXPLAIN the hot Review and Place queries against a local PostGIS database and exit with status 1
+if any of them reads review, place or user with a sequential scan, or sorts when an index should
+already return its rows in order.
+
+Run it against a scratch database that `flask db upgrade` has been applied to, seeding it first:
+
+    QUERY_PLAN_DATABASE_URI=postgresql://localhost/eatout_plans python scripts/check_query_plans.py --seed
+'''
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db, models
+from geoalchemy2 import func as geo
+from sqlalchemy import func
+
+
+CHECKED_TABLES = {'review', 'place', 'user'}
+
+# Queries whose ORDER BY an index is declared for
+INDEX_ORDERED = {'reviews of a user by rating (GET /r)'}
+
+
+def seed(users, places, reviews):
+    db.session.execute('''
+        INSERT INTO "user" (email)
+        SELECT 'seed-' || md5(random()::text) || '@example.com' FROM generate_series(1, :users)
+    ''', {'users': users})
+    db.session.execute('''
+        INSERT INTO place (name, location, place_type, rating)
+        SELECT 'Seed place ' || md5(random()::text),
+               ST_MakePoint(37.3 + random() * 0.6, 55.5 + random() * 0.4)::geography,
+               1 + i % 3,
+               (random() * 50)::int
+        FROM generate_series(1, :places) i
+    ''', {'places': places})
+    # Ratings go to random users and places of the scratch database, whose IDs are contiguous
+    db.session.execute('''
+        INSERT INTO review (user_id, place_id, rating)
+        SELECT u.min + floor(random() * (u.max - u.min + 1))::int,
+               p.min + floor(random() * (p.max - p.min + 1))::int,
+               1 + floor(random() * 5)::int
+        FROM generate_series(1, :reviews),
+             (SELECT min(id), max(id) FROM "user") u,
+             (SELECT min(id), max(id) FROM place) p
+        ON CONFLICT (user_id, place_id) DO NOTHING
+    ''', {'reviews': reviews})
+    db.session.commit()
+
+    db.session.execute('ANALYZE')
+    db.session.commit()
+
+
+def hot_queries():
+    user_id = db.session.query(models.Review.user_id).limit(1).scalar()
+    place = models.Place.query.filter(models.Place.location.isnot(None)).first()
+    point = 'POINT({} {})'.format(place.longitude, place.latitude)
+    name = place.name[len(place.name) // 2:][:8]
+
+    return {
+        'review by user and place (rating upsert)':
+            models.Review.query.filter_by(user_id=user_id, place_id=place.id),
+        'reviews of a user by rating (GET /r)':
+            models.Review.query.filter(models.Review.user_id == user_id)
+                               .order_by(models.Review.rating.desc().nullslast(), models.Review.id).limit(50),
+        'reviews of a place':
+            models.Review.query.filter(models.Review.place_id == place.id),
+        'places within a radius':
+            db.session.query(models.Place.id).filter(geo.ST_DWithin(models.Place.location, point, 2000)),
+        'places of a type within a radius':
+            db.session.query(models.Place.id).filter(geo.ST_DWithin(models.Place.location, point, 2000),
+                                                     models.Place.place_type == models.PLACE_BAR),
+        'place name search (/p/search)':
+            db.session.query(models.Place.id).filter(models.Place.name.ilike('%' + name + '%'))
+                                             .order_by(func.similarity(models.Place.name, name).desc()).limit(50),
+    }
+
+
+def plan_nodes(plan):
+    yield plan
+    for subplan in plan.get('Plans', []):
+        yield from plan_nodes(subplan)
+
+
+def problems(description, plan):
+    for node in plan_nodes(plan):
+        if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') in CHECKED_TABLES:
+            yield 'sequential scan on {}'.format(node['Relation Name'])
+        if node['Node Type'] in ('Sort', 'Incremental Sort') and description in INDEX_ORDERED:
+            yield 'sort on {}'.format(', '.join(node.get('Sort Key', [])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', action='store_true', help='insert synthetic rows and ANALYZE first')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--places', type=int, default=50000)
+    parser.add_argument('--reviews', type=int, default=500000)
+    args = parser.parse_args()
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('QUERY_PLAN_DATABASE_URI',
+                                                           app.config['SQLALCHEMY_DATABASE_URI'])
+
+    failed = False
+    with app.app_context():
+        if args.seed:
+            seed(args.users, args.places, args.reviews)
+
+        for description, query in hot_queries().items():
+            statement = query.statement.compile(dialect=db.engine.dialect)
+            # Plain strings go to the driver as they are, in its own parameter style
+            plan = db.session.connection().execute('EXPLAIN (FORMAT JSON) ' + str(statement),
+                                                   statement.params).scalar()
+            found = sorted(set(problems(description, plan[0]['Plan'])))
+
+            if found:
+                failed = True
+                print('FAIL {}: {}'.format(description, '; '.join(found)))
+            else:
+                print('ok   {}'.format(description))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+from app.cache import RecommendationCache
+import numpy as np
+
+
+class FakeRecommender:
+    '''
+    Ranks places by ID, recording the calls it gets
+    '''
+    def __init__(self, place_ids, version='v1'):
+        self.place_ids = np.array(place_ids)
+        self.n_places = len(place_ids)
+        self.version = version
+        self.calls = []
+
+    def recommend(self, user_id, filter_place_ids=None, k=None):
+        self.calls.append((user_id, filter_place_ids, k))
+        ranking = self.place_ids
+        if filter_place_ids is not None:
+            ranking = ranking[np.isin(ranking, filter_place_ids)]
+        return ranking[:k]
+
+
+def test_recommend_caches_the_ranking():
+    recommender = FakeRecommender([5, 4, 3, 2, 1])
+    cache = RecommendationCache(max_size=10, depth=3, cache_dir=None)
+
+    assert cache.recommend(recommender, 1, k=2).tolist() == [5, 4]
+    assert cache.recommend(recommender, 1).tolist() == [5, 4, 3]
+    assert recommender.calls == [(1, None, 3)]
+
+
+def test_recommend_filters_the_cached_ranking():
+    recommender = FakeRecommender([5, 4, 3, 2, 1])
+    cache = RecommendationCache(max_size=10, depth=3, cache_dir=None)
+
+    assert cache.recommend(recommender, 1, [3, 5], k=2).tolist() == [5, 3]
+    assert cache.recommend(recommender, 1, [], k=2).tolist() == []
+    assert len(recommender.calls) == 1
+
+
+def test_recommend_scores_filtered_places_missing_from_a_truncated_ranking():
+    recommender = FakeRecommender([5, 4, 3, 2, 1])
+    cache = RecommendationCache(max_size=10, depth=3, cache_dir=None)
+
+    # 1 and 2 are past the cached depth, so the filtered places are scored directly
+    assert cache.recommend(recommender, 1, [4, 2, 1], k=3).tolist() == [4, 2, 1]
+    assert recommender.calls[-1] == (1, [4, 2, 1], 3)
+
+
+def test_recommend_does_not_fall_back_on_a_complete_ranking():
+    recommender = FakeRecommender([3, 2, 1])
+    cache = RecommendationCache(max_size=10, depth=5, cache_dir=None)
+
+    # Unknown places can not be ranked, the complete ranking already has every known one
+    assert cache.recommend(recommender, 1, [2, 99], k=2).tolist() == [2]
+    assert len(recommender.calls) == 1
+
+
+def test_rankings_of_another_version_are_not_served():
+    cache = RecommendationCache(max_size=10, depth=3, cache_dir=None)
+    cache.recommend(FakeRecommender([5, 4, 3], 'v1'), 1)
+
+    recommender = FakeRecommender([3, 4, 5], 'v2')
+    cache.switch(recommender)
+
+    assert cache.get(1, 'v2') is None
+    assert cache.recommend(recommender, 1).tolist() == [3, 4, 5]
+
+
+def test_disk_tier_is_shared_per_version(tmp_path):
+    recommender = FakeRecommender([5, 4, 3, 2, 1])
+    RecommendationCache(max_size=10, depth=3, cache_dir=str(tmp_path)).recommend(recommender, 1)
+
+    other = RecommendationCache(max_size=10, depth=3, cache_dir=str(tmp_path))
+    assert other.get(1, 'v1').tolist() == [5, 4, 3]
+    assert other.get(1, 'v2') is None
+
+    other.switch(FakeRecommender([1], 'v2'))
+    assert not (tmp_path / 'v1').exists()
+
+
+def test_lru_evicts_the_least_recently_used_user():
+    recommender = FakeRecommender([2, 1])
+    cache = RecommendationCache(max_size=2, depth=2, cache_dir=None)
+
+    for user_id in (1, 2):
+        cache.recommend(recommender, user_id)
+    cache.get(1, 'v1')
+    cache.recommend(recommender, 3)
+
+    assert list(cache.rankings) == [1, 3]
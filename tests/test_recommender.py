@@ -0,0 +1,181 @@
+from app.recommender import top_k, IdMap, CombinedRecommender, LIGHTFM_ARRAYS
+from app.training import ReviewRecord, TrainingReview
+import numpy as np
+import pytest
+
+
+USER_IDS = [10, 20, 30, 40]
+PLACE_IDS = [100, 200, 300, 400, 500]
+REVIEWS = [(10, 100, 5), (10, 200, 2), (20, 200, 5), (20, 300, 1), (30, 400, 5),
+           (30, 100, 3), (40, 500, 5), (40, 300, 4)]
+
+
+def fitted_recommender():
+    '''
+    Small recommender fitted without the database, the way CombinedRecommender.fit does it
+    '''
+    recommender = CombinedRecommender(positive_epochs=2, negative_epochs=2,
+                                      user_ids=np.array(USER_IDS), place_ids=np.array(PLACE_IDS))
+    reviews = np.array(REVIEWS)
+    positive, negative, negative_weights = recommender.build_interactions(reviews[:, 0], reviews[:, 1],
+                                                                          reviews[:, 2])
+    recommender.positive_model.fit(positive, epochs=2)
+    recommender.negative_model.fit(negative, sample_weight=negative_weights, epochs=2)
+    return recommender
+
+
+def test_top_k_orders_by_descending_score():
+    scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3])
+
+    assert top_k(scores, 3).tolist() == [1, 3, 2]
+    assert top_k(scores).tolist() == [1, 3, 2, 4, 0]
+
+
+def test_top_k_with_k_of_zero_or_at_least_n():
+    scores = np.array([0.1, 0.9, 0.5])
+
+    assert top_k(scores, 0).tolist() == []
+    assert top_k(scores, 3).tolist() == [1, 2, 0]
+    assert top_k(scores, 10).tolist() == [1, 2, 0]
+
+
+def test_top_k_ranks_each_row():
+    scores = np.array([[0.1, 0.9, 0.5],
+                       [0.8, 0.2, 0.4]])
+
+    assert top_k(scores, 2).tolist() == [[1, 2], [0, 2]]
+
+
+def test_id_map_positions_and_lookup_of_unknown_ids():
+    id_map = IdMap([30, 10, 20])
+
+    assert id_map[10] == 1
+    assert id_map.positions([20, 99, 30]).tolist() == [2, -1, 0]
+    assert id_map.lookup([20, 99, 30]).tolist() == [2, 0]
+    assert 99 not in id_map
+    with pytest.raises(KeyError):
+        id_map[99]
+
+
+def test_id_map_extend_keeps_existing_positions():
+    id_map = IdMap([30, 10]).extend([5, 40])
+
+    assert len(id_map) == 4
+    assert list(id_map) == [30, 10, 5, 40]
+    assert id_map.positions([30, 10, 5, 40, 7]).tolist() == [0, 1, 2, 3, -1]
+
+
+def test_id_map_save_and_load(tmp_path):
+    IdMap([30, 10, 20]).save(str(tmp_path), 'users')
+    id_map = IdMap.load(str(tmp_path), 'users', mmap_mode='r')
+
+    assert list(id_map) == [30, 10, 20]
+    assert id_map.positions([20, 99]).tolist() == [2, -1]
+
+
+def test_build_interactions_skips_unknown_users_and_places():
+    recommender = CombinedRecommender(user_ids=np.array(USER_IDS), place_ids=np.array(PLACE_IDS))
+    positive, negative, negative_weights = recommender.build_interactions([10, 99, 20, 30], [100, 100, 999, 200],
+                                                                          [5, 5, 5, 2])
+
+    assert positive.shape == negative.shape == (len(USER_IDS), len(PLACE_IDS))
+    assert list(zip(positive.row, positive.col)) == [(0, 0)]
+    assert list(zip(negative.row, negative.col)) == [(2, 1)]
+    assert negative_weights.data.tolist() == [3]
+
+
+def test_grow_then_fit_partial():
+    recommender = fitted_recommender()
+    before = {attr: np.array(getattr(recommender.positive_model, attr)) for attr in LIGHTFM_ARRAYS}
+
+    recommender.grow([10, 50], [100, 600, 700])
+
+    assert list(recommender.user_model_map) == USER_IDS + [50]
+    assert recommender.place_ids.tolist() == PLACE_IDS + [600, 700]
+    assert recommender.n_places == len(PLACE_IDS) + 2
+
+    for model in (recommender.positive_model, recommender.negative_model):
+        for attr in LIGHTFM_ARRAYS:
+            array = getattr(model, attr)
+            rows = len(USER_IDS) + 1 if attr.startswith('user_') else len(PLACE_IDS) + 2
+            assert array.dtype == np.float32
+            assert array.shape[0] == rows
+            if 'embedding' in attr:
+                assert array.shape[1] == model.no_components
+
+        # New rows start with adagrad accumulators at one and no momentum
+        assert np.all(model.user_embedding_gradients[-1] == 1)
+        assert np.all(model.item_bias_gradients[-2:] == 1)
+        assert np.all(model.item_embedding_momentum[-2:] == 0)
+
+    for attr in LIGHTFM_ARRAYS:
+        old_rows = before[attr].shape[0]
+        assert np.array_equal(getattr(recommender.positive_model, attr)[:old_rows], before[attr])
+
+    recommender.fit_partial([ReviewRecord(50, 600, 5), ReviewRecord(50, 100, 1), ReviewRecord(10, 700, 5)],
+                            save=False)
+
+    assert np.all(np.isfinite(recommender.positive_model.user_embeddings))
+    assert sorted(recommender.recommend(50).tolist()) == sorted(PLACE_IDS + [600, 700])
+    assert recommender.recommend(50, filter_place_ids=[600, 999, 300]).tolist() in ([600, 300], [300, 600])
+
+
+def test_recommend_batch_matches_recommend():
+    recommender = fitted_recommender()
+    rankings = recommender.recommend_batch(USER_IDS, 3, chunk_size=3)
+
+    assert rankings.shape == (len(USER_IDS), 3)
+    for user_id, ranking in zip(USER_IDS, rankings):
+        assert ranking.tolist() == recommender.recommend(user_id, k=3).tolist()
+
+    assert recommender.recommend_batch(USER_IDS, 0).shape == (len(USER_IDS), 0)
+
+
+def test_reviews_committed_out_of_order_are_trained_once():
+    recommender = fitted_recommender()
+    recommender.trained_until = 99
+
+    # B (101) commits before A (100), the worker trains on B first
+    recommender.mark_trained([101])
+    assert recommender.trained_until == 101
+
+    # Reading the window below trained_until again finds A, and drops B
+    committed = [TrainingReview(100, 10, 300, 5), TrainingReview(101, 20, 100, 4)]
+    assert recommender.untrained(committed) == [committed[0]]
+
+    recommender.mark_trained([100])
+    assert recommender.trained_until == 101
+    assert recommender.untrained(committed) == []
+    assert recommender.untrained([TrainingReview(102, 10, 200, 3)]) == [TrainingReview(102, 10, 200, 3)]
+
+
+def test_mark_trained_forgets_numbers_below_the_window():
+    recommender = fitted_recommender()
+    recommender.trained_until = 0
+
+    recommender.mark_trained([5, 50, 90], window=20)
+    recommender.mark_trained([95], window=20)
+
+    assert recommender.trained_until == 95
+    assert recommender.trained_recent.tolist() == [90, 95]
+
+
+def test_saved_version_serves_memory_mapped_and_trains_in_memory(tmp_path):
+    recommender = fitted_recommender()
+    recommender.trained_until = 0
+    recommender.mark_trained([40, 42])
+    recommender.save(str(tmp_path))
+
+    served = CombinedRecommender()
+    served.load(str(tmp_path))
+    assert served.version == recommender.version
+    assert served.trained_until == 42
+    assert served.trained_recent.tolist() == [40, 42]
+    assert not served.positive_model.user_embeddings.flags.writeable
+    assert served.recommend(20).tolist() == recommender.recommend(20).tolist()
+
+    trained = CombinedRecommender()
+    trained.load(str(tmp_path), mmap_mode=None)
+    trained.grow([50], [])
+    trained.fit_partial([ReviewRecord(50, 300, 5)], save=False)
+    assert len(trained.recommend(50)) == len(PLACE_IDS)
@@ -0,0 +1,64 @@
+from app.search import AutocompleteIndex, normalize
+
+
+PLACES = [(1, 'Ёлки-Палки'), (2, 'Кофемания'), (3, 'Coffee Bean'), (4, 'Кофе Хауз'), (5, 'Пушкин')]
+
+
+def autocomplete_index(places=PLACES):
+    '''
+    Index over (id, name) pairs, built the way AutocompleteIndex.build does without the database
+    '''
+    index = AutocompleteIndex(ttl=60)
+    index.data = sorted((key, id, name) for id, name in places for key in index._keys(name))
+    index.loaded_at = 0
+    return index
+
+
+def test_normalize():
+    assert normalize('  Ёлки-Палки!! ') == 'елки палки'
+    assert normalize('Café  «Пушкин»') == 'cafe пушкин'
+    assert normalize('BAR_№1') == 'bar no1'
+    assert normalize('...') == ''
+
+
+def test_keys_start_at_every_word_in_both_alphabets():
+    assert AutocompleteIndex._keys('Ёлки-Палки') == {'елки палки', 'палки', 'elki palki', 'palki'}
+    assert AutocompleteIndex._keys('Coffee Bean') == {'coffee bean', 'bean'}
+    assert AutocompleteIndex._keys('!!!') == set()
+
+
+def test_complete_cyrillic_and_latin_prefixes():
+    index = autocomplete_index()
+
+    assert index.complete('ёлк') == [(1, 'Ёлки-Палки')]
+    assert index.complete('елк') == [(1, 'Ёлки-Палки')]
+    assert index.complete('elk') == [(1, 'Ёлки-Палки')]
+    assert index.complete('pushk') == [(5, 'Пушкин')]
+    assert index.complete('палк') == [(1, 'Ёлки-Палки')]
+
+
+def test_complete_in_key_order_without_duplicates():
+    index = autocomplete_index()
+
+    # Кофе Хауз matches through both "кофе хауз" and its transliteration "kofe khauz" only once
+    assert index.complete('кофе') == [(4, 'Кофе Хауз'), (2, 'Кофемания')]
+    assert index.complete('kofe') == [(4, 'Кофе Хауз'), (2, 'Кофемания')]
+    assert index.complete('co') == [(3, 'Coffee Bean')]
+
+
+def test_complete_limit_and_empty_prefix():
+    index = autocomplete_index()
+
+    assert index.complete('коф', limit=1) == [(4, 'Кофе Хауз')]
+    assert index.complete('') == []
+    assert index.complete('?!') == []
+    assert index.complete('шаурма') == []
+
+
+def test_add_makes_a_place_completable():
+    index = autocomplete_index()
+    index.add(6, 'Хинкальная')
+    index.add(7, None)
+
+    assert index.complete('хинк') == [(6, 'Хинкальная')]
+    assert index.complete('khink') == [(6, 'Хинкальная')]
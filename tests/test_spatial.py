@@ -0,0 +1,63 @@
+from app.spatial import PlaceIndex, haversine, METERS_PER_DEGREE
+import numpy as np
+
+
+def place_index(places, cell_size=0.02):
+    '''
+    Index over (id, lat, lon, place_type) tuples, built without the database
+    '''
+    index = PlaceIndex(cell_size=cell_size, ttl=60)
+    index.data = index._build(*zip(*places))
+    index.loaded_at = 0
+    return index
+
+
+def test_haversine_along_a_meridian():
+    assert np.isclose(haversine(55.0, 37.0, np.array([56.0]), np.array([37.0]))[0], METERS_PER_DEGREE)
+
+
+def test_query_finds_places_across_cell_edges():
+    # On either side of the lat = 0.02 and lon = 0.04 edges, about 30 m apart
+    index = place_index([(1, 0.0199, 0.0399, 1), (2, 0.0201, 0.0401, 1), (3, 0.0199, 0.0401, 1)])
+
+    assert index.query(0.02, 0.04, 50).tolist() == [1, 2, 3]
+    assert index.query(0.0199, 0.0399, 20).tolist() == [1]
+
+
+def test_query_filters_by_radius_within_a_cell():
+    # 0.001 degrees of latitude is about 111 m
+    index = place_index([(1, 55.751, 37.61, 1), (2, 55.752, 37.61, 1), (3, 55.755, 37.61, 1)])
+
+    assert index.query(55.751, 37.61, 100).tolist() == [1]
+    assert index.query(55.751, 37.61, 120).tolist() == [1, 2]
+    assert index.query(55.751, 37.61, 500).tolist() == [1, 2, 3]
+
+
+def test_query_radius_larger_than_a_cell():
+    index = place_index([(1, 55.75, 37.61, 1), (2, 55.80, 37.61, 1), (3, 55.90, 37.61, 1)])
+
+    # 0.05 degrees of latitude, about 5.6 km, spans several cells
+    assert index.query(55.75, 37.61, 6000).tolist() == [1, 2]
+
+
+def test_query_by_place_type_and_without_coordinates():
+    index = place_index([(1, 55.75, 37.61, 1), (2, 55.75, 37.61, 2), (3, np.nan, np.nan, 2)])
+
+    assert index.query(55.75, 37.61, 100, place_type=2).tolist() == [2]
+    # Places without coordinates only match queries without a location
+    assert index.query(place_type=2).tolist() == [2, 3]
+    assert index.query().tolist() == [1, 2, 3]
+
+
+def test_query_far_from_every_place():
+    index = place_index([(1, 55.75, 37.61, 1)])
+
+    assert index.query(59.93, 30.31, 1000).tolist() == []
+
+
+def test_add_indexes_a_new_place():
+    index = place_index([(1, 55.75, 37.61, 1)])
+    index.add(2, 55.7501, 37.61, 3)
+
+    assert index.query(55.75, 37.61, 50).tolist() == [1, 2]
+    assert index.query(place_type=3).tolist() == [2]
@@ -5,7 +5,60 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
+import sys
+
 
 class TripadvisorScraperPipeline(object):
+    '''
+    Writes scraped restaurants and their reviews to the eatout database in batches
+    and retrains the recommender once when the crawl ends
+    '''
+    def __init__(self, app_root, batch_size, retrain):
+        self.app_root = app_root
+        self.batch_size = batch_size
+        self.retrain = retrain
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get('EATOUT_ROOT'),
+                   crawler.settings.getint('IMPORT_BATCH_SIZE'),
+                   crawler.settings.getbool('IMPORT_RETRAIN'))
+
+    def open_spider(self, spider):
+        # The Flask app lives outside of the scrapy project and needs its database settings,
+        # so it is only imported when the pipeline is enabled
+        if self.app_root not in sys.path:
+            sys.path.insert(0, self.app_root)
+        from app import app
+        from app.importer import TripadvisorImporter
+
+        self.context = app.app_context()
+        self.context.push()
+        self.importer = TripadvisorImporter(self.batch_size)
+
+    def close_spider(self, spider):
+        try:
+            self.write(spider)
+            spider.logger.info('Imported %d places and %d reviews',
+                               self.importer.imported_places, self.importer.imported_reviews)
+            self.importer.finish(self.retrain)
+        finally:
+            self.context.pop()
+
     def process_item(self, item, spider):
+        self.write(spider, item)
         return item
+
+    def write(self, spider, item=None):
+        '''
+        Add item to the import, or flush what is buffered. Once a write fails the spider does not
+        save its crawl state, so the restaurants that were lost are crawled again by the next run
+        '''
+        try:
+            if item is None:
+                self.importer.flush()
+            else:
+                self.importer.add(dict(item))
+        except Exception:
+            spider.import_failed = True
+            raise
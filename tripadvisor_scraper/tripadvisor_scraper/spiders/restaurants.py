@@ -2,13 +2,22 @@ import scrapy
 from scrapy.http import Request
 from scrapy.utils.project import get_project_settings
 from urllib.parse import urljoin
+import json
+import os
 import re
 
 
+# Review pages differ only by the offset of their first review, e.g. ...-Reviews-or20-...
+REVIEWS_OFFSET = re.compile('-or([0-9]+)-')
+# Ratings are rendered as e.g. "ui_bubble_rating bubble_45" for 4.5
+BUBBLE_RATING = re.compile('bubble_([0-9]{2})')
+MEMBER_UID = re.compile('UID_([0-9a-fA-F]*)')
+
+
 class RestaurantsSpider(scrapy.Spider):
     name = 'restaurants'
 
-    def __init__(self, category='', **kwargs):
+    def __init__(self, category='', incremental='', **kwargs):
         settings = get_project_settings()
 
         self.base_url = settings.get('BASE_URL')
@@ -18,20 +27,68 @@ class RestaurantsSpider(scrapy.Spider):
 
         self.max_pages = settings.get('MAX_PAGES')
 
+        # With -a incremental=1 restaurants are skipped if their review count has not changed since
+        # the last crawl, and review pages are only followed until the newest review seen then
+        self.incremental = incremental.lower() in ('1', 'true', 'yes')
+        self.state_file = settings.get('CRAWL_STATE_FILE')
+        try:
+            with open(self.state_file) as f:
+                self.crawl_state = json.load(f)
+        except FileNotFoundError:
+            self.crawl_state = {}
+
+        # Review pages still being fetched in parallel, by restaurant URL
+        self.pending_pages = {}
+        # Set by the import pipeline when items could not be stored
+        self.import_failed = False
+
         super().__init__(**kwargs)
 
+    def closed(self, reason):
+        # Restaurants are remembered as soon as they are parsed, which only holds if their items were stored.
+        # Pipelines are closed before this runs, so a failed final flush is seen here too
+        if self.import_failed:
+            self.logger.warning('Import failed, crawl state left at the previous run')
+            return
+
+        # Write to a temporary file first so an interrupted write does not lose the previous state
+        tmp_path = self.state_file + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.crawl_state, f)
+        os.replace(tmp_path, self.state_file)
+
+    def remember(self, restaurant_url, num_reviews, newest_review):
+        self.crawl_state[restaurant_url] = {'num_reviews': num_reviews, 'newest_review': newest_review}
+
     def link(self, relative_path):
         return urljoin(self.base_url, relative_path)
 
+    def review_page_urls(self, response, next_page_url):
+        '''
+        (page number, URL) of all review pages after the first one, None if they can not be derived
+        from the offset in the next page URL
+        '''
+        offset = REVIEWS_OFFSET.search(next_page_url)
+        page_numbers = [int(number) for number in response.css('div.pageNumbers a.pageNum::text').extract()
+                        if number.strip().isdigit()]
+        if offset is None or not page_numbers:
+            return None
+
+        # The second page starts right after the first one
+        page_size = int(offset.group(1))
+        return [(page, self.link(REVIEWS_OFFSET.sub('-or{}-'.format((page - 1) * page_size), next_page_url, 1)))
+                for page in range(2, max(page_numbers) + 1)]
+
     def parse(self, response):
         pagenum = response.meta['pagenum'] if 'pagenum' in response.meta else 1
 
         restaurants_selectors = response.css('div#EATERY_SEARCH_RESULTS div.listing')
 
         for selector in restaurants_selectors:
+            title = selector.css('div.title a.property_title')
             restaurant = {}
-            restaurant['url'] =  selector.css('div.title a.property_title::attr(href)').extract_first()
-            restaurant['name'] = selector.css('div.title a.property_title::text').extract_first().strip()
+            restaurant['url'] =  title.xpath('@href').extract_first()
+            restaurant['name'] = title.xpath('text()').extract_first().strip()
 
             yield Request(url=self.link(restaurant['url']), meta={'restaurant': restaurant},
                           callback=self.parse_restaurant_page)
@@ -47,24 +104,24 @@ class RestaurantsSpider(scrapy.Spider):
     def parse_restaurant_page(self, response):
         restaurant = response.meta['restaurant']
 
-        restaurant['street_address'] = response.css('div#BODYCON div.address span.street-address::text')\
-                                               .extract_first()
-        restaurant['locality'] =       response.css('div#BODYCON div.address span.locality::text')\
-                                               .extract_first()
-        restaurant['country'] =        response.css('div#BODYCON div.address span.country-name::text')\
-                                               .extract_first()
-        restaurant['cuisine'] =        response.css('div#BODYCON div.centerWell div.text::text')\
-                                               .extract_first()
+        # Containers are selected once and the fields looked up inside them, not from the document root
+        body = response.css('div#BODYCON')
+        address = body.css('div.address')
+
+        restaurant['street_address'] = address.css('span.street-address::text').extract_first()
+        restaurant['locality'] =       address.css('span.locality::text').extract_first()
+        restaurant['country'] =        address.css('span.country-name::text').extract_first()
+        restaurant['cuisine'] =        body.css('div.centerWell div.text::text').extract_first()
 
+        header_rating = response.css('span.header_rating')
         try:
-            rating_str = response.css('''span.header_rating
-                                         span.ui_bubble_rating::attr(class)''').extract_first()
-            restaurant['avg_rating'] = int(re.findall('bubble_[0-9]{2}', rating_str)[0][7:]) / 10.0
+            rating_str = header_rating.css('span.ui_bubble_rating::attr(class)').re_first(BUBBLE_RATING)
+            restaurant['avg_rating'] = int(rating_str) / 10.0
 
-            numratings_str = response.css('''span.header_rating a.more span::text''').extract_first()
+            numratings_str = header_rating.css('a.more span::text').extract_first()
             restaurant['num_reviews'] = int(numratings_str.replace(' ', ''))
 
-        except (ValueError, TypeError, IndexError):
+        except (ValueError, TypeError, AttributeError):
             restaurant['avg_rating'] = None
             restaurant['num_reviews'] = None
 
@@ -74,17 +131,39 @@ class RestaurantsSpider(scrapy.Spider):
         except IndexError:
             pass
 
+        for key in restaurant.keys():
+            try:
+                # Remove spaces and commas that tripadvisor sometimes insert
+                restaurant[key] = restaurant[key].strip(' ,')
+            except AttributeError:
+                pass
+
+        known = self.crawl_state.get(restaurant['url'], {})
+        if (self.incremental and restaurant['num_reviews'] is not None and
+                known.get('num_reviews') == restaurant['num_reviews']):
+            return
+
+        # Reviews follow as separate items linked by restaurant_url, so only the URL is carried along
+        yield restaurant
+
         reviews_page_url = response.css('''div#REVIEWS div.calloutReviewList
                                                     div.review-container div.quote a::attr(href)''')\
                                    .extract_first()
-        restaurant['reviews'] = []
 
         if reviews_page_url:
-            yield Request(url=self.link(reviews_page_url), meta={'restaurant': restaurant, 'pagenum': 1},
+            yield Request(url=self.link(reviews_page_url),
+                          meta={'restaurant_url': restaurant['url'],
+                                'num_reviews': restaurant['num_reviews'],
+                                'known_review': known.get('newest_review') if self.incremental else None,
+                                'pagenum': 1},
                           callback=self.parse_reviews)
+        else:
+            self.remember(restaurant['url'], restaurant['num_reviews'], known.get('newest_review'))
 
     def parse_reviews(self, response):
-        restaurant = response.meta['restaurant']
+        meta = {key: response.meta.get(key) for key in ('restaurant_url', 'num_reviews', 'known_review',
+                                                        'newest_review', 'parallel')}
+        restaurant_url = meta['restaurant_url']
         pagenum = response.meta['pagenum']
 
         try:
@@ -95,44 +174,65 @@ class RestaurantsSpider(scrapy.Spider):
         if pagenum == 1 and actual_pagenum != 1:
             first_page_url = response.css('div.pageNumbers a.pageNum.first::attr(href)').extract_first()
             if first_page_url:
-                yield Request(url=self.link(first_page_url), meta={'restaurant': restaurant, 'pagenum': 1},
+                yield Request(url=self.link(first_page_url),
+                              meta=dict(meta, pagenum=1),
                               callback=self.parse_reviews)
             return
 
-        reviews_selectors = response.css('div#REVIEWS div.calloutReviewList div.reviewSelector')
+        reviews = response.css('div#REVIEWS')
+        reviews_selectors = reviews.css('div.calloutReviewList div.reviewSelector')
+        reached_known = False
 
         for selector in reviews_selectors:
-            review = {}
+            # Reviews are listed newest first, from the newest one of the last crawl on they are stored already
+            review_id = selector.xpath('@id').extract_first()
+            if review_id is not None and review_id == meta['known_review']:
+                reached_known = True
+                break
+            if meta['newest_review'] is None:
+                meta['newest_review'] = review_id
 
-            try:
-                uid_str = selector.css('div.member_info div.memberOverlayLink::attr(id)').extract_first()
-                review['uid'] = re.findall('UID_[0-9a-fA-F]*', uid_str)[0][4:]
-            except (TypeError, IndexError):
-                review['uid'] = None
+            review = {'restaurant_url': restaurant_url}
+
+            review['uid'] = selector.css('div.member_info div.memberOverlayLink::attr(id)').re_first(MEMBER_UID)
 
             try:
-                rating_str = selector.css('''div.reviewItemInline
-                                            span.ui_bubble_rating::attr(class)''').extract_first()
-                review['rating'] = int(re.findall('bubble_[0-9]{2}', rating_str)[0][7:]) / 10.0
+                rating_str = selector.css('div.reviewItemInline span.ui_bubble_rating::attr(class)')\
+                                     .re_first(BUBBLE_RATING)
+                review['rating'] = int(rating_str) / 10.0
 
-            except (ValueError, TypeError, IndexError):
+            except (ValueError, TypeError):
                 review['rating'] = None
 
             review['title'] = selector.css('div.quote a span.noQuotes::text').extract_first()
             review['content'] = selector.css('div.entry p.partial_entry::text').extract_first()
 
-            restaurant['reviews'].append(review)
+            yield review
 
-        next_page_url = response.css('div#REVIEWS a.nav.next::attr(href)').extract_first()
-        if next_page_url:
-            yield Request(url=self.link(next_page_url),
-                          meta={'restaurant': restaurant, 'pagenum': actual_pagenum + 1},
-                          callback=self.parse_reviews)
+        if meta['parallel']:
+            self.pending_pages[restaurant_url] -= 1
+            if self.pending_pages[restaurant_url] == 0:
+                del self.pending_pages[restaurant_url]
+                self.remember(restaurant_url, meta['num_reviews'], meta['newest_review'])
+            return
+
+        next_page_url = reviews.css('a.nav.next::attr(href)').extract_first()
+        if next_page_url and not reached_known:
+            # A full crawl of a restaurant fetches all its review pages at once, an incremental one
+            # only needs the first few and follows next links until it reaches a stored review
+            page_urls = None
+            if actual_pagenum == 1 and meta['known_review'] is None:
+                page_urls = self.review_page_urls(response, next_page_url)
+
+            if page_urls:
+                self.pending_pages[restaurant_url] = len(page_urls)
+                for page, url in page_urls:
+                    yield Request(url=url, meta=dict(meta, pagenum=page, parallel=True),
+                                  callback=self.parse_reviews)
+            else:
+                yield Request(url=self.link(next_page_url),
+                              meta=dict(meta, pagenum=actual_pagenum + 1),
+                              callback=self.parse_reviews)
         else:
-            for key in restaurant.keys():
-                try:
-                    # Remove spaces and commas that tripadvisor sometimes insert
-                    restaurant[key] = restaurant[key].strip(' ,')
-                except AttributeError:
-                    pass
-            yield restaurant
+            # Recorded only once all new reviews are through, so an interrupted crawl picks them up next time
+            self.remember(restaurant_url, meta['num_reviews'], meta['newest_review'] or meta['known_review'])